@@ -1,117 +1,460 @@
+import copy
+import os
+import time
+from src.checkpoint import Checkpoint, DEFAULT_INTERVAL
+from src import yao
+from src.compare import BACKENDS, Millionaires
 from src.garbler import YaoGarbler
-from src.util import GarblerSocket
+from src.util import GarblerSocket, DEFAULT_ENDPOINT
 from src.ot import ObliviousTransfer
+from src.metrics import Metrics, NULL_METRICS
 import utils
 
 
 class Alice(YaoGarbler):
+    socket_class = GarblerSocket
+    ot_class = ObliviousTransfer
+
     def __init__(self,
                  circuits: str,
                  oblivious_transfer=True,
                  bit_size=4,
                  inputs_file='inputs_alice.txt',
-                 logs_file="logs_alice.json"
+                 logs_file="logs_alice.json",
+                 metrics=False,
+                 endpoint=DEFAULT_ENDPOINT,
+                 aggregate=False,
+                 store=None,
+                 compress=True,
+                 checkpoint=None,
+                 checkpoint_interval=DEFAULT_INTERVAL,
+                 netem=None,
+                 sequential=False,
+                 lazy=False,
+                 raw_log=None,
+                 backend="garbled"
                  ):
-        super().__init__(circuits)
-        self.socket = GarblerSocket(logs_file)
-        self.ot = ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+        if sequential and (store is not None or checkpoint is not None):
+            raise ValueError("Sequential circuits are garbled online, without store or checkpoint")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+        if backend != "garbled" and (store is not None or checkpoint is not None or sequential):
+            raise ValueError(f"The {backend} backend uses no circuit, it has no store, checkpoint or sequential mode")
+
+        self.metrics = Metrics('alice') if metrics else NULL_METRICS
+        self.sequential = sequential
+
+        # resume the session of the last checkpoint, if any
+        self.checkpoint = Checkpoint(checkpoint, checkpoint_interval) if checkpoint else None
+        self.resume = self.checkpoint.load() if self.checkpoint else None
+        setup = self.checkpoint.load_setup() if self.resume else None
+
+        # circuits are not garbled unless used
+        super().__init__(circuits, metrics=self.metrics, store=store,
+                         garbled=setup["garbled"] if setup and store is None else None,
+                         lazy=lazy or backend != "garbled")
+        self.socket = self.socket_class(logs_file, endpoint=endpoint, metrics=self.metrics,
+                                        compress=compress, netem=netem, raw_log=raw_log)
+        self.ot = self.ot_class(self.socket, enabled=oblivious_transfer)
+        # inputs compared without circuit, see src.compare
+        self.comparison = Millionaires(self.ot, bit_size) if backend == "millionaires" else None
+
+        self.inputs = utils.load_inputs(inputs_file, bit_size)
+        if aggregate or sequential:
+            # a single secure evaluation on the local maxima, or the initial
+            # accumulator of a sequential circuit
+            self.inputs = self.inputs.aggregate()
 
-        self.inputs = utils.parse_input_file(inputs_file, bit_size)
-        self.global_max = -1
+        if self.resume:
+            self.session = self.resume["session"]
+            self.global_max = self.resume["global_max"]
+        else:
+            self.session = os.urandom(8).hex()
+            self.global_max = -1
+            if self.checkpoint:
+                self.checkpoint.save_setup({"garbled": self.garbled()})
 
     def start(self):
-        for circuit in self.circuits:
-            # send circuit info to bob
-            self.socket.send_wait({
-                "circuit": circuit["circuit"],
-                "garbled_tables": circuit["garbled_tables"],
-                "pbits_out": circuit["pbits_out"],
-                "type": "circuit"
-            })
+        # agree on payload compression
+        self.socket.negotiate()
+
+        if self.comparison is not None:
+            self._compare()
+
+        for index, circuit in self._pending_circuits():
+            message, instance, instances = self._open_circuit(index, circuit)
+
+            # send circuit info and number of inputs to bob, get bob's number of inputs
+            reply = self.socket.send_wait(message)
+            if reply.get("missing"):  # bob does not have the circuit, send its spec
+                reply = self.socket.send_wait(circuit["circuit"])
 
             # start with evaluation
-            self._evaluate(circuit)
+            self._evaluate(circuit, reply["inputs"], instance, instances,
+                           min(message["round"], reply["round"]))
+            if reply.get("deferred"):  # bob evaluated in worker processes
+                for result in self.socket.send_wait({'type': 'results'}):
+                    self._record(result)
+            self._save(index + 1, 0)
 
         # evaluation complete
         self.socket.send_wait({
             'type': 'exit'
         })
+        self.socket.close()
+        if self.checkpoint:
+            self.checkpoint.clear()
+
+    def _evaluate(self, message, bob_inputs, instance, instances, start_round=0):
+        rounds = self._rounds(message, bob_inputs, instance, instances, start_round)
+        for ctr, (a_inputs, b_keys, fresh) in enumerate(rounds, start_round):
+            start = time.perf_counter()
+
+            # evaluate circuit
+            result = self.ot.get_result(a_inputs, b_keys, fresh)
+            self._record(result, start)
+            self._save(self._circuit_index, ctr + 1)
+
+    def _compare(self):
+        """Compare inputs with the comparison backend, in place of the
+        circuits."""
+        reply = self.socket.send_wait({
+            "inputs": len(self.inputs),
+            "bits": self.inputs.bit_size,
+            "block": self.comparison.block_bits,
+            "type": "compare"
+        })
+
+        # both parties use their inputs at least once, cycling through the shorter list
+        for ctr in range(max(len(self.inputs), reply["inputs"])):
+            start = time.perf_counter()
+            self._record(self.comparison.garbler_max(self.inputs[ctr % len(self.inputs)]), start)
+
+    def _pending_circuits(self):
+        """Iterate over the circuits not completed before the checkpoint,
+        none with a comparison backend."""
+        if self.comparison is not None:
+            return
+        first = self.resume["circuit"] if self.resume else 0
+        for index, circuit in enumerate(self.circuits):
+            if index >= first:
+                yield index, circuit
+
+    def _open_circuit(self, index, circuit):
+        """Return the circuit message with the first instance to use and the
+        iterator over the following ones."""
+        first_round, start = 0, 0
+        if self.resume and self.resume["circuit"] == index:
+            first_round = self.resume["round"]
+            if self.resume["instance"] is not None:
+                start = self.resume["instance"][1] + 1  # never reuse a store instance
+
+        instances = self.instances(circuit, start)
+        instance = next(instances)
+        self._circuit_index, self._instance = index, instance
+        return self._circuit_message(index, circuit, instance, first_round), instance, instances
+
+    def _circuit_message(self, index, circuit, instance, first_round=0):
+        return {
+            # bob looks the circuit up by hash, see src.topology
+            "circuit": None,
+            "hash": yao.circuit_hash(circuit["circuit"]),
+            "garbled_tables": instance["garbled_tables"],
+            # outputs of a sequential circuit are only decoded in the last round
+            "pbits_out": None if self.sequential else instance["pbits_out"],
+            "inputs": len(self.inputs),
+            "sequential": self.sequential,
+            "session": self.session,
+            "index": index,
+            "round": first_round,  # first round not completed before the checkpoint
+            "type": "circuit"
+        }
+
+    def _rounds(self, message, bob_inputs, instance, instances, start_round=0):
+        """Yield the arguments of ObliviousTransfer.get_result for each round."""
+        if self.sequential:
+            yield from self._sequential_rounds(message, bob_inputs, instance)
+            return
 
-    def _evaluate(self, message):
         circuit = message["circuit"]
-        pbits = message["pbits"]
-        keys = message["keys"]
 
         a_wires = circuit.get("alice", [])  # Alice's wires
         a_inputs = {}  # map from Alice's wires to (key, encr_bit) inputs
         b_wires = circuit.get("bob", [])  # Bob's wires
-        b_keys = {  # map from Bob's wires to a pair (key, encr_bit)
-            w: self._get_encr_bits(pbits[w], key0, key1)
-            for w, (key0, key1) in keys.items() if w in b_wires
-        }
 
-        has_alice_exhausted = False
-        has_bob_exhausted = False
-
-        ctr = 0
-        # loop until both parties have used their input at least once
-        while not has_bob_exhausted or not has_alice_exhausted:
-            # reset
-            if ctr == len(self.inputs):
-                ctr = 0
-                has_alice_exhausted = True
-
-            # get bob's input status and send self's status
-            has_bob_exhausted = self.socket.send_wait({
-                'type': 'exhausted',
-                'value': has_alice_exhausted
-            })
+        # both parties use their inputs at least once, cycling through the shorter list
+        rounds = max(len(self.inputs), bob_inputs)
+
+        for ctr in range(start_round, rounds):
+            # the first instance was sent along with the circuit
+            fresh = None
+            if ctr > start_round:
+                previous, instance = instance, next(instances)
+                if instance is not previous:
+                    fresh = {
+                        "garbled_tables": instance["garbled_tables"],
+                        "pbits_out": instance["pbits_out"],
+                    }
+
+            if ctr == start_round or fresh is not None:
+                pbits = instance["pbits"]
+                keys = instance["keys"]
+                b_keys = {  # map from Bob's wires to a pair (key, encr_bit)
+                    w: self._get_encr_bits(pbits[w], *keys[w]) for w in b_wires
+                }
+                self._instance = instance
 
             # get current input, extract individual bits as int
-            bits_a = [int(x) for x in self.inputs[ctr]]
-            ctr += 1
+            bits_a = self.inputs.bits(ctr % len(self.inputs))
 
             # map input to wires in circuit
             for i in range(len(a_wires)):
                 a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]], pbits[a_wires[i]] ^ bits_a[i])
 
-            # evaluate circuit
-            result = self.ot.get_result(a_inputs, b_keys)
+            yield a_inputs, b_keys, fresh
 
-            self.socket.messages.append({
-                'type': 'intermediate result',
-                'data': result
-            })
+    def _sequential_rounds(self, message, bob_inputs, instance):
+        """Rounds of a sequential circuit: Alice's input only feeds the first
+        round, the carried wires of each next instance get the output labels
+        of the previous one. Only the last round decodes its outputs."""
+        circuit = message["circuit"]
+        carry = yao.carry_wires(circuit)  # output wire -> Alice's wire
 
-            result_int = utils.parse_circuit_output(result)
+        a_wires = circuit.get("alice", [])  # Alice's wires
+        b_wires = circuit.get("bob", [])  # Bob's wires
+        bits_a = self.inputs.bits(0)
+
+        for ctr in range(bob_inputs):
+            if ctr:
+                previous = instance
+                garbled_circuit = yao.GarbledCircuit(
+                    circuit,
+                    pbits={inp: previous["pbits"][out] for out, inp in carry.items()},
+                    keys={inp: previous["keys"][out] for out, inp in carry.items()},
+                    metrics=self.metrics)
+                instance = self.entry(circuit, garbled_circuit)
+
+            last = ctr == bob_inputs - 1
+            fresh = None
+            if ctr or last:
+                fresh = {
+                    "garbled_tables": instance["garbled_tables"],
+                    "pbits_out": instance["pbits_out"] if last else None,
+                }
+
+            pbits = instance["pbits"]
+            keys = instance["keys"]
+            b_keys = {  # map from Bob's wires to a pair (key, encr_bit)
+                w: self._get_encr_bits(pbits[w], *keys[w]) for w in b_wires
+            }
+            a_inputs = {  # Bob holds the labels of carried wires after the first round
+                w: (keys[w][bits_a[i]], pbits[w] ^ bits_a[i])
+                for i, w in enumerate(a_wires) if ctr == 0 or w not in carry.values()
+            }
+
+            yield a_inputs, b_keys, fresh
+
+    def _record(self, result, start=None):
+        if start is not None:
+            self.metrics.observe('evaluation_latency', time.perf_counter() - start)
+        if result is None:  # intermediate round of a sequential circuit, or deferred
+            return
+
+        self.socket.messages.append({
+            'type': 'intermediate result',
+            'data': result
+        })
 
-            # update locally stored global max
-            if result_int > self.global_max:
-                self.global_max = result_int
+        # the comparison backend returns the max, a circuit its output bits
+        result_int = result if isinstance(result, int) else utils.parse_circuit_output(result)
+
+        # update locally stored global max
+        if result_int > self.global_max:
+            self.global_max = result_int
+
+    def _save(self, index, rounds_done):
+        """Checkpoint the session once 'rounds_done' rounds of a circuit are
+        completed (every round of the previous circuits for 0)."""
+        if self.checkpoint is None or (rounds_done and not self.checkpoint.due(rounds_done)):
+            return
+        self.checkpoint.save({
+            "session": self.session,
+            "circuit": index,
+            "round": rounds_done,
+            "global_max": self.global_max,
+            "instance": self._instance.get("id") if rounds_done else None,  # last store instance used
+        })
 
     @staticmethod
     def _get_encr_bits(pbit, key0, key1):
         return (key0, 0 ^ pbit), (key1, 1 ^ pbit)
 
 
+class AsyncAlice(Alice):
+    """Alice driven by an asyncio event loop.
+
+    Each instance is one protocol session: many sessions, on distinct
+    endpoints, can run concurrently on the same loop.
+    """
+    def __init__(self, *args, **kwargs):
+        if kwargs.get("backend", "garbled") != "garbled":
+            raise ValueError("Asyncio sessions only run the garbled backend")
+
+        # asyncio is only imported by async sessions
+        from src.aio import AsyncGarblerSocket, AsyncObliviousTransfer
+        self.socket_class = AsyncGarblerSocket
+        self.ot_class = AsyncObliviousTransfer
+        super().__init__(*args, **kwargs)
+
+    async def start(self):
+        try:
+            await self.socket.negotiate()
+
+            for index, circuit in self._pending_circuits():
+                message, instance, instances = self._open_circuit(index, circuit)
+                reply = await self.socket.send_wait(message)
+                if reply.get("missing"):
+                    reply = await self.socket.send_wait(circuit["circuit"])
+                await self._evaluate(circuit, reply["inputs"], instance, instances,
+                                     min(message["round"], reply["round"]))
+                if reply.get("deferred"):
+                    for result in await self.socket.send_wait({'type': 'results'}):
+                        self._record(result)
+                self._save(index + 1, 0)
+
+            await self.socket.send_wait({
+                'type': 'exit'
+            })
+        finally:
+            self.socket.close()
+        if self.checkpoint:
+            self.checkpoint.clear()
+
+    async def _evaluate(self, message, bob_inputs, instance, instances, start_round=0):
+        rounds = self._rounds(message, bob_inputs, instance, instances, start_round)
+        for ctr, (a_inputs, b_keys, fresh) in enumerate(rounds, start_round):
+            start = time.perf_counter()
+            result = await self.ot.get_result(a_inputs, b_keys, fresh)
+            self._record(result, start)
+            self._save(self._circuit_index, ctr + 1)
+
+    async def run(self, timeout=None):
+        """Run the session and return the global max.
+
+        Args:
+            timeout: Optional; seconds after which the session is cancelled
+                and asyncio.TimeoutError raised.
+        """
+        import asyncio
+        await asyncio.wait_for(self.start(), timeout)
+        return self.global_max
+
+
+class MuxAlice(AsyncAlice):
+    """AsyncAlice running her circuits concurrently over one connection.
+
+    Circuits are dealt in turn to 'channels' logical channels of a
+    Multiplexer (see src.mux), while one waits for Bob another one works.
+    Each channel is a session of its own (compression, circuits, exit)
+    driven by a copy of this Alice sharing her circuits and inputs; the
+    control channel closes the connection once all are done.
+
+    Args:
+        channels: Number of channels.
+        Other arguments are those of Alice, a checkpoint is not supported.
+    """
+    def __init__(self, *args, channels=2, **kwargs):
+        if kwargs.get("checkpoint") is not None:
+            raise ValueError("Multiplexed circuits complete out of order, they cannot be checkpointed")
+        if kwargs.get("backend", "garbled") != "garbled":
+            raise ValueError("Multiplexed sessions only run the garbled backend")
+
+        from functools import partial
+        from src.aio import AsyncObliviousTransfer
+        from src.mux import CONTROL, ChannelSocket, Multiplexer
+        self.mux = Multiplexer(kwargs.get("endpoint", DEFAULT_ENDPOINT), bind=False)
+        self.channels = channels
+        self._assigned = None  # circuits of a channel copy
+        self._channel_options = {"compress": kwargs.get("compress", True), "netem": kwargs.get("netem")}
+
+        # the socket of Alice is the control channel
+        self.socket_class = partial(ChannelSocket, self.mux, CONTROL)
+        self.ot_class = AsyncObliviousTransfer
+        Alice.__init__(self, *args, **kwargs)
+
+    def _channel(self, channel, circuits):
+        """Return a copy of this Alice evaluating 'circuits' on a channel."""
+        from src.mux import ChannelSocket
+        alice = copy.copy(self)
+        alice.socket = ChannelSocket(self.mux, channel, self.socket.logs_file, metrics=self.metrics,
+                                     **self._channel_options)
+        alice.ot = self.ot_class(alice.socket, enabled=self.ot.enabled)
+        alice._assigned = circuits
+        return alice
+
+    def _pending_circuits(self):
+        if self._assigned is not None:
+            return iter(self._assigned)
+        return super()._pending_circuits()
+
+    async def start(self):
+        import asyncio
+        circuits = list(self._pending_circuits())
+        sessions = [self._channel(channel + 1, circuits[channel::self.channels])
+                    for channel in range(min(self.channels, len(circuits)))]
+        try:
+            await asyncio.gather(*(AsyncAlice.start(session) for session in sessions))
+            await self.socket.send_wait({
+                'type': 'exit'
+            })
+        finally:
+            await self.mux.close()
+
+        for session in sessions:
+            self.global_max = max(self.global_max, session.global_max)
+            self.socket.messages.extend(session.socket.messages)
+
+
 if __name__ == '__main__':
     import argparse
-    import os
+    import asyncio
+    from functools import partial
+    from src import netem
+    from src.replay import SCHEME
 
     parser = argparse.ArgumentParser(prog="Yao Protocol - Alice", description="Run Alice(Garbler) in yao protocol")
     parser.add_argument("-c", "--circuit", help="Path to circuit file", default="4bit_max.json")
     parser.add_argument("-b", "--bit-size", help="Number of input wires for a party in the circuit", default=4)
-    parser.add_argument("-i", "--input-file", help="Path to input file (.txt)", default="inputs_alice.txt")
+    parser.add_argument("-i", "--input-file", help="Path to input file (.txt or .bin)", default="inputs_alice.txt")
     parser.add_argument("-l", "--log-file", help="Path for log file (.json)", default="logs_alice.json")
     parser.add_argument("--disable-ot", action="store_true", help="Disables oblivious transfer")
+    parser.add_argument("-e", "--endpoint", help="Endpoint of Bob (tcp://, inproc://, shm:// or replay://)", default=DEFAULT_ENDPOINT)
+    parser.add_argument("-s", "--store", help="Path to a store of pre-garbled circuits (see src.store)", default=None)
+    parser.add_argument("--aggregate", action="store_true", help="Reduce own inputs locally before one secure evaluation")
+    parser.add_argument("--lazy", action="store_true", help="Garble each circuit just before it is used")
+    parser.add_argument("--sequential", action="store_true", help="Carry the running max between evaluations as garbled labels")
+    parser.add_argument("--channels", help="Number of circuits run concurrently over one connection (0: one after another)", default=0)
+    parser.add_argument("--backend", choices=BACKENDS, help="Garbled circuits, or a millionaires' protocol comparing inputs without circuit", default="garbled")
+    parser.add_argument("--disable-compression", action="store_true", help="Disables payload compression")
+    parser.add_argument("--checkpoint", help="Path of the session checkpoint, resumed if it exists", default=None)
+    parser.add_argument("--checkpoint-interval", help="Number of rounds between two checkpoints", default=DEFAULT_INTERVAL)
+    parser.add_argument("--netem", help="Path to a network profiles file (.json) to emulate a link", default=None)
+    parser.add_argument("--netem-profile", help="Name of the emulated network profile (default: first one)", default=None)
+    parser.add_argument("-r", "--raw-log", help="Path for a raw log of the messages, replayable with -e replay://PATH", default=None)
+    parser.add_argument("--metrics", action="store_true", help="Collect and print protocol metrics")
+    parser.add_argument("-m", "--metrics-file", help="Path for metrics export (.json)", default=None)
 
     args = parser.parse_args()
 
     # Check args
     # Circuit
-    if not os.path.exists(args.circuit):
+    if args.store is None and not os.path.exists(args.circuit):
         raise FileNotFoundError(f"Circuit file not found: {args.circuit}")
 
+    # Store
+    if args.store is not None and not os.path.exists(args.store):
+        raise FileNotFoundError(f"Store not found: {args.store}")
+
     # Bits size for circuit
     if not isinstance(int(args.bit_size), int):
         raise ValueError("Bit size must be of the type int")
@@ -120,8 +463,8 @@ if __name__ == '__main__':
     if not os.path.exists(args.input_file):
         raise FileNotFoundError(f"Input file file not found: {args.input_file}")
 
-    if ".txt" not in args.input_file:
-        raise Exception(f"Input file must be a .txt file: {args.input_file}")
+    if ".txt" not in args.input_file and ".bin" not in args.input_file:
+        raise Exception(f"Input file must be a .txt or .bin file: {args.input_file}")
 
     # Log file
     if ".json" not in args.log_file:
@@ -131,13 +474,68 @@ if __name__ == '__main__':
     if not isinstance(args.disable_ot, bool):
         raise ValueError("Disable oblivious transfer must be of the type bool")
 
-    a = Alice(
+    # Checkpoint
+    if int(args.checkpoint_interval) < 1:
+        raise ValueError("Checkpoint interval must be a positive int")
+
+    # Sequential
+    if args.sequential and (args.store is not None or args.checkpoint is not None):
+        raise ValueError("Sequential circuits are garbled online, without store or checkpoint")
+
+    # Backend
+    if args.backend != "garbled" and (args.store is not None or args.checkpoint is not None or args.sequential):
+        raise ValueError(f"The {args.backend} backend uses no circuit, it has no store, checkpoint or sequential mode")
+
+    if args.backend != "garbled" and int(args.channels):
+        raise ValueError("Multiplexed sessions only run the garbled backend")
+
+    # Channels
+    if int(args.channels) < 0:
+        raise ValueError("Number of channels must be a non-negative int")
+
+    if int(args.channels) and (args.endpoint.startswith("shm://") or args.endpoint.startswith(SCHEME)):
+        raise ValueError("Channels need a zmq endpoint (tcp://, ipc:// or inproc://)")
+
+    # Network emulation
+    if args.netem is not None and not os.path.exists(args.netem):
+        raise FileNotFoundError(f"Network profiles file not found: {args.netem}")
+
+    # Replay
+    if args.endpoint.startswith(SCHEME) and not os.path.exists(args.endpoint[len(SCHEME):]):
+        raise FileNotFoundError(f"Raw log not found: {args.endpoint[len(SCHEME):]}")
+
+    # Metrics file
+    if args.metrics_file is not None and ".json" not in args.metrics_file:
+        raise Exception(f"Metrics file must be a .json file: {args.metrics_file}")
+
+    party = partial(MuxAlice, channels=int(args.channels)) if int(args.channels) else Alice
+    a = party(
         circuits=args.circuit,
         oblivious_transfer=not args.disable_ot,
         bit_size=int(args.bit_size),
         inputs_file=args.input_file,
-        logs_file=args.log_file
+        logs_file=args.log_file,
+        metrics=args.metrics or args.metrics_file is not None,
+        endpoint=args.endpoint,
+        aggregate=args.aggregate,
+        store=args.store,
+        compress=not args.disable_compression,
+        checkpoint=args.checkpoint,
+        checkpoint_interval=int(args.checkpoint_interval),
+        netem=netem.load_profile(args.netem, args.netem_profile) if args.netem else None,
+        sequential=args.sequential,
+        lazy=args.lazy,
+        raw_log=args.raw_log,
+        backend=args.backend
     )
-    a.start()
+    if int(args.channels):
+        asyncio.run(a.run())
+    else:
+        a.start()
     a.socket.create_logs_file()
     print(f'Computed global max: {a.global_max}')
+
+    if a.metrics.enabled:
+        a.metrics.print_summary()
+    if args.metrics_file:
+        a.metrics.export(args.metrics_file)
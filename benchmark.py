@@ -0,0 +1,114 @@
+import json
+import multiprocessing
+import time
+from alice import Alice
+from bob import Bob
+from main import supervise
+from src.netem import load_profiles
+
+
+def _party(party_class, kwargs, ready, results):
+    party = party_class(**kwargs)
+    ready.wait()  # both parties are set up, the clock starts
+    start = time.perf_counter()
+    party.start()
+    results.put((party_class.__name__, time.perf_counter() - start, party.global_max, party.metrics.summary()))
+
+
+def run(circuits: str, inputs_alice: str, inputs_bob: str, bit_size: int, endpoint: str, profile=None,
+        oblivious_transfer: bool = True):
+    """Run one session between alice and bob over an emulated link.
+
+    Each party runs in its own process, so they do not share a GIL.
+
+    Returns:
+        A dict with the profile, the wall time in seconds and the metrics of
+        both parties.
+    """
+    context = multiprocessing.get_context("spawn")  # as in src.pool
+    ready = context.Barrier(2)
+    results = context.SimpleQueue()
+    bob = dict(oblivious_transfer=oblivious_transfer, bit_size=bit_size, inputs_file=inputs_bob, metrics=True,
+               endpoint=endpoint, netem=profile)
+    alice = dict(circuits=circuits, oblivious_transfer=oblivious_transfer, bit_size=bit_size,
+                 inputs_file=inputs_alice, metrics=True, endpoint=endpoint, netem=profile)
+
+    parties = [context.Process(target=_party, args=(Bob, bob, ready, results)),
+               context.Process(target=_party, args=(Alice, alice, ready, results))]
+    for party in parties:
+        party.start()
+    if not supervise(parties):
+        raise RuntimeError(f"A party failed: {[party.exitcode for party in parties]}")
+
+    reports = {}
+    while not results.empty():
+        name, seconds, global_max, summary = results.get()
+        reports[name] = {'seconds': seconds, 'global_max': global_max, 'metrics': summary}
+    if len(reports) != 2:
+        raise RuntimeError(f"A party failed: {[party.exitcode for party in parties]}")
+    if reports['Alice']['global_max'] != reports['Bob']['global_max']:
+        raise RuntimeError(f"Parties disagree: {reports['Alice']['global_max']} != {reports['Bob']['global_max']}")
+
+    return {
+        'profile': profile.to_json() if profile else None,
+        'seconds': max(report['seconds'] for report in reports.values()),
+        'alice': reports['Alice']['metrics'],
+        'bob': reports['Bob']['metrics'],
+    }
+
+
+def print_run(result):
+    profile = result['profile'] or {'name': 'none', 'rtt_ms': 0, 'bandwidth_mbps': None}
+    counters = result['alice']['counters']
+    bandwidth = profile.get('bandwidth_mbps')
+    print(f"  {profile['name']:<18} rtt {profile['rtt_ms']:8.2f} ms  "
+          f"bw {bandwidth or 0:8.1f} Mbit/s  "
+          f"runtime {result['seconds']:10.3f} s  "
+          f"round trips {counters.get('round_trips', 0):8}  "
+          f"bytes {counters.get('bytes_sent', 0) + counters.get('bytes_received', 0):12}")
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(prog="Yao Protocol - benchmark",
+                                     description="Measure runtime as a function of RTT and bandwidth on emulated links")
+    parser.add_argument("-c", "--circuit", help="Path to circuit file", default="4bit_max.json")
+    parser.add_argument("-b", "--bit-size", help="Number of input wires for a party in the circuit", default=4)
+    parser.add_argument('-ia', '--input_alice', help="Path to alice's input file", default="inputs_alice.txt")
+    parser.add_argument('-ib', '--input_bob', help="Path to bob's input file", default="inputs_bob.txt")
+    parser.add_argument("-e", "--endpoint", help="Endpoint shared by alice and bob (tcp:// or shm://)", default="tcp://localhost:4090")
+    parser.add_argument("-n", "--netem", help="Path to the network profiles file (.json)", default="netem_profiles.json")
+    parser.add_argument("-p", "--profiles", nargs="*", help="Names of the profiles to run (default: all)", default=None)
+    parser.add_argument("--baseline", action="store_true", help="Also run without emulation")
+    parser.add_argument("--disable-ot", action="store_true", help="Disables oblivious transfer")
+    parser.add_argument("-o", "--output", help="Path for the results (.json)", default=None)
+
+    args = parser.parse_args()
+
+    # Check args
+    for path in (args.circuit, args.input_alice, args.input_bob, args.netem):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+
+    if args.output is not None and ".json" not in args.output:
+        raise Exception(f"Output file must be a .json file: {args.output}")
+
+    profiles = load_profiles(args.netem)
+    if args.profiles:
+        profiles = [profile for profile in profiles if profile.name in args.profiles]
+    if args.baseline:
+        profiles.insert(0, None)
+
+    results = []
+    print(f"======== benchmark {args.circuit} ========")
+    for profile in profiles:
+        result = run(args.circuit, args.input_alice, args.input_bob, int(args.bit_size), args.endpoint, profile,
+                     oblivious_transfer=not args.disable_ot)
+        print_run(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(json.dumps({'circuit': args.circuit, 'runs': results}, indent=4))
@@ -1,92 +1,341 @@
-from src.util import EvaluatorSocket
+import copy
+import time
+from src import yao
+from src.checkpoint import Checkpoint, DEFAULT_INTERVAL
+from src.compare import Millionaires
+from src.util import EvaluatorSocket, LOCAL_PORT
 from src.ot import ObliviousTransfer
+from src.pool import EvaluationPool
+from src.topology import TopologyCache
+from src.metrics import Metrics, NULL_METRICS
 import utils
 
 
 class Bob:
+    socket_class = EvaluatorSocket
+    ot_class = ObliviousTransfer
+
     def __init__(self,
                  oblivious_transfer=True,
                  bit_size=4,
                  inputs_file='inputs_bob.txt',
-                 logs_file="logs_bob.json"
+                 logs_file="logs_bob.json",
+                 metrics=False,
+                 endpoint=f"tcp://*:{LOCAL_PORT}",
+                 aggregate=False,
+                 compress=True,
+                 checkpoint=None,
+                 checkpoint_interval=DEFAULT_INTERVAL,
+                 netem=None,
+                 workers=0,
+                 raw_log=None,
+                 circuit_cache=None
                  ):
-        self.socket = EvaluatorSocket(logs_file)
-        self.ot = ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+        self.metrics = Metrics('bob') if metrics else NULL_METRICS
+        # evaluations deferred to worker processes while OTs go on
+        self.pool = EvaluationPool(workers) if workers else None
+        # circuits alice sent, she only sends the hash of a known one
+        self.topology = TopologyCache(circuit_cache)
+
+        # the session of the last checkpoint is resumed if alice resumes it too
+        self.checkpoint = Checkpoint(checkpoint, checkpoint_interval) if checkpoint else None
+        self.resume = self.checkpoint.load() if self.checkpoint else None
+
+        self.socket = self.socket_class(logs_file, endpoint=endpoint, metrics=self.metrics,
+                                        compress=compress, netem=netem, raw_log=raw_log)
+        self.ot = self.ot_class(self.socket, enabled=oblivious_transfer)
 
-        self.inputs = utils.parse_input_file(inputs_file, bit_size)
+        self.inputs = utils.load_inputs(inputs_file, bit_size)
+        if aggregate:
+            # a single secure evaluation on the local maxima
+            self.inputs = self.inputs.aggregate()
         self.global_max = -1
 
     def start(self):
         for message in self.socket.poll_socket():
-            if message['type'] == 'circuit':
-                self.socket.send(True)
-                self._evaluate(message)  # start with evaluation
+            if message['type'] == 'hello':  # agree on payload compression
+                self.socket.answer(message)
+            elif message['type'] == 'circuit':
+                message["circuit"] = self.topology.get(message["hash"])
+                if message["circuit"] is None:  # unknown circuit, alice sends its spec
+                    spec = self.socket.send_wait({"missing": True})
+                    message["circuit"] = self.topology.add(spec, message["hash"])
+
+                # number of inputs for the schedule and round to resume from
+                reply = self._circuit_reply(message)
+                self.socket.send(reply)
+                self._evaluate(message, min(message["round"], reply["round"]))  # start with evaluation
+            elif message['type'] == 'compare':  # inputs compared without circuit, see src.compare
+                self.socket.send(self._compare_reply(message))
+                self._compare(message)
             elif message['type'] == 'exit':  # evaluation complete
                 self.socket.send(True)
                 break
 
-    def _evaluate(self, message):
+        self.socket.close()
+        self._close()
+
+    def _close(self):
+        if self.pool is not None:
+            self.pool.close()
+        if self.checkpoint:
+            self.checkpoint.clear()
+
+    def _evaluate(self, message, start_round=0):
         circuit = message["circuit"]
-        pbits_out = message["pbits_out"]
-        garbled_tables = message["garbled_tables"]
+        tables = message["garbled_tables"], message["pbits_out"]
+        self._carry(message)
+
+        for ctr, b_inputs_clear in enumerate(self._rounds(message, start_round), start_round):
+            start = time.perf_counter()
+
+            # evaluate circuit
+            result = self.ot.send_result(circuit, *tables, b_inputs_clear)
+            tables = self._current_tables(tables)
+            self._record(result, start)
+            self._save(message, ctr + 1)
+
+        if self.ot.pool is not None:
+            self.socket.receive()  # alice asks for the deferred results
+            self.socket.send(self._collect())
 
-        b_wires = circuit.get("bob", [])  # list of Bob's wires
+    def _collect(self):
+        """Record the results of the deferred evaluations and return them."""
+        results = self.ot.pool.results()
+        for result in results:
+            self._record(result)
+        return results
 
-        has_alice_exhausted = False
-        has_bob_exhausted = False
+    def _compare_reply(self, message):
+        if message["bits"] != self.inputs.bit_size:
+            raise ValueError(f"Alice compares {message['bits']} bit inputs, Bob has {self.inputs.bit_size} bits")
+        return {"inputs": len(self.inputs)}
 
-        ctr = 0
-        # loop until both parties have used their input at least once
-        while not has_bob_exhausted or not has_alice_exhausted:
-            # reset
-            if ctr == len(self.inputs):
-                ctr = 0
-                has_bob_exhausted = True
+    def _compare(self, message):
+        comparison = Millionaires(self.ot, message["bits"], message["block"])
 
-            # get alice's input status
-            data = self.socket.receive()
+        # both parties use their inputs at least once, cycling through the shorter list
+        for ctr in range(max(message["inputs"], len(self.inputs))):
+            start = time.perf_counter()
+            self._record(comparison.evaluator_max(self.inputs[ctr % len(self.inputs)]), start)
 
-            # send self's status to alice
-            if data['type'] == 'exhausted':
-                self.socket.send(has_bob_exhausted)
-                has_alice_exhausted = data['value']
-            else:
-                raise Exception("Invalid message type")
+    def _circuit_reply(self, message):
+        """Return the number of inputs of Bob and the first round of the
+        circuit not completed before his checkpoint (0 for a new session)."""
+        state, self.resume = self.resume, None
+        first_round = 0
+        if state is not None and state["session"] == message["session"]:
+            self.global_max = state["global_max"]
+            if state["circuit"] == message["index"]:
+                first_round = state["round"]
 
+        return {
+            "inputs": len(self.inputs),
+            "round": first_round,
+            "deferred": self._deferred(message)
+        }
+
+    def _deferred(self, message):
+        # results of a sequential circuit are needed by the next round, and a
+        # checkpoint must not miss results still pending in the pool
+        return self.pool is not None and not message.get("sequential") and self.checkpoint is None
+
+    def _carry(self, message):
+        # outputs of a sequential circuit feed its next evaluation as labels
+        self.ot.carry = yao.carry_wires(message["circuit"]) if message.get("sequential") else None
+        self.ot.carried = {}
+        self.ot.pool = self.pool if self._deferred(message) else None
+
+    def _rounds(self, message, start_round=0):
+        """Yield Bob's clear inputs for each round."""
+        b_wires = message["circuit"].get("bob", [])  # list of Bob's wires
+
+        # both parties use their inputs at least once, cycling through the shorter list;
+        # a sequential circuit folds each of Bob's inputs into the running max
+        rounds = max(message["inputs"], len(self.inputs))
+        if message.get("sequential"):
+            rounds = len(self.inputs)
+
+        for ctr in range(start_round, rounds):
             # get current input, extract individual bits as int
-            bits_b = [int(x) for x in self.inputs[ctr]]
-            ctr += 1
+            bits_b = self.inputs.bits(ctr % len(self.inputs))
 
             # map input to wires in circuit
-            b_inputs_clear = {
+            yield {
                 b_wires[i]: bits_b[i]
                 for i in range(len(b_wires))
             }
 
-            # evaluate circuit
-            result = self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear)
+    def _current_tables(self, tables):
+        # alice sent a fresh instance, used until the next one
+        instance = self.ot.received_instance
+        if instance is not None:
+            return instance["garbled_tables"], instance["pbits_out"]
+        return tables
 
-            self.socket.messages.append({
-                'type': 'intermediate result',
-                'data': result
-            })
+    def _record(self, result, start=None):
+        if start is not None:
+            self.metrics.observe('evaluation_latency', time.perf_counter() - start)
+        if result is None:  # intermediate round of a sequential circuit, or deferred
+            return
 
-            result_int = utils.parse_circuit_output(result)
+        self.socket.messages.append({
+            'type': 'intermediate result',
+            'data': result
+        })
 
-            # update locally stored global max
-            if result_int > self.global_max:
-                self.global_max = result_int
+        # the comparison backend returns the max, a circuit its output bits
+        result_int = result if isinstance(result, int) else utils.parse_circuit_output(result)
+
+        # update locally stored global max
+        if result_int > self.global_max:
+            self.global_max = result_int
+
+    def _save(self, message, rounds_done):
+        if self.checkpoint is None or not self.checkpoint.due(rounds_done):
+            return
+        self.checkpoint.save({
+            "session": message["session"],
+            "circuit": message["index"],
+            "round": rounds_done,
+            "global_max": self.global_max,
+        })
+
+
+class AsyncBob(Bob):
+    """Bob driven by an asyncio event loop, see AsyncAlice."""
+    def __init__(self, *args, **kwargs):
+        # asyncio is only imported by async sessions
+        from src.aio import AsyncEvaluatorSocket, AsyncObliviousTransfer
+        self.socket_class = AsyncEvaluatorSocket
+        self.ot_class = AsyncObliviousTransfer
+        super().__init__(*args, **kwargs)
+
+    async def start(self):
+        try:
+            while True:
+                message = await self.socket.receive()
+                if message['type'] == 'hello':
+                    await self.socket.answer(message)
+                elif message['type'] == 'circuit':
+                    message["circuit"] = self.topology.get(message["hash"])
+                    if message["circuit"] is None:
+                        spec = await self.socket.send_wait({"missing": True})
+                        message["circuit"] = self.topology.add(spec, message["hash"])
+                    reply = self._circuit_reply(message)
+                    await self.socket.send(reply)
+                    await self._evaluate(message, min(message["round"], reply["round"]))
+                elif message['type'] == 'exit':
+                    await self.socket.send(True)
+                    break
+        finally:
+            self.socket.close()
+        self._close()
+
+    async def _evaluate(self, message, start_round=0):
+        circuit = message["circuit"]
+        tables = message["garbled_tables"], message["pbits_out"]
+        self._carry(message)
+
+        for ctr, b_inputs_clear in enumerate(self._rounds(message, start_round), start_round):
+            start = time.perf_counter()
+            result = await self.ot.send_result(circuit, *tables, b_inputs_clear)
+            tables = self._current_tables(tables)
+            self._record(result, start)
+            self._save(message, ctr + 1)
+
+        if self.ot.pool is not None:
+            await self.socket.receive()
+            await self.socket.send(self._collect())
+
+    async def run(self, timeout=None):
+        """Run the session and return the global max, see AsyncAlice.run."""
+        import asyncio
+        await asyncio.wait_for(self.start(), timeout)
+        return self.global_max
+
+
+class MuxBob(AsyncBob):
+    """AsyncBob serving the channels of a MuxAlice over one connection.
+
+    Each channel opened by Alice is served by a copy of this Bob sharing
+    his inputs, until Alice closes the connection on the control channel.
+    Evaluations are not deferred to worker processes and a checkpoint is
+    not supported.
+    """
+    def __init__(self, *args, **kwargs):
+        if kwargs.get("checkpoint") is not None:
+            raise ValueError("Multiplexed circuits complete out of order, they cannot be checkpointed")
+
+        from functools import partial
+        from src.aio import AsyncObliviousTransfer
+        from src.mux import CONTROL, ChannelSocket, Multiplexer
+        self.mux = Multiplexer(kwargs.get("endpoint", f"tcp://*:{LOCAL_PORT}"), bind=True)
+        self._channel_options = {"compress": kwargs.get("compress", True), "netem": kwargs.get("netem")}
+
+        # the socket of Bob is the control channel
+        self.socket_class = partial(ChannelSocket, self.mux, CONTROL)
+        self.ot_class = AsyncObliviousTransfer
+        Bob.__init__(self, *args, **kwargs)
+
+    def _channel(self, channel):
+        """Return a copy of this Bob serving a channel."""
+        from src.mux import ChannelSocket
+        bob = copy.copy(self)
+        bob.socket = ChannelSocket(self.mux, channel, self.socket.logs_file, metrics=self.metrics,
+                                   **self._channel_options)
+        bob.ot = self.ot_class(bob.socket, enabled=self.ot.enabled)
+        bob.pool = None
+        return bob
+
+    async def start(self):
+        import asyncio
+        from src.mux import CONTROL
+        sessions, tasks = [], []
+        try:
+            while (channel := await self.mux.accept()) != CONTROL:
+                sessions.append(self._channel(channel))
+                tasks.append(asyncio.create_task(AsyncBob.start(sessions[-1])))
+            await asyncio.gather(*tasks)
+
+            await self.socket.receive()  # exit
+            await self.socket.send(True)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.mux.close()
+        self._close()
+
+        for session in sessions:
+            self.global_max = max(self.global_max, session.global_max)
+            self.socket.messages.extend(session.socket.messages)
 
 
 if __name__ == '__main__':
     import argparse
+    import asyncio
+    from src import netem
+    from src.replay import SCHEME
     import os
 
     parser = argparse.ArgumentParser(prog="Yao Protocol - Bob", description="Run Bob(Evaluator) in yao protocol")
     parser.add_argument("-b", "--bit-size", help="Number of input wires for a party in the circuit", default=4)
-    parser.add_argument("-i", "--input-file", help="Path to input file (.txt)", default="inputs_bob.txt")
+    parser.add_argument("-i", "--input-file", help="Path to input file (.txt or .bin)", default="inputs_bob.txt")
     parser.add_argument("-l", "--log-file", help="Path for log file (.json)", default="logs_bob.json")
     parser.add_argument("--disable-ot", action="store_true", help="Disables oblivious transfer")
+    parser.add_argument("-e", "--endpoint", help="Endpoint to listen on (tcp://, inproc://, shm:// or replay://)", default=f"tcp://*:{LOCAL_PORT}")
+    parser.add_argument("--aggregate", action="store_true", help="Reduce own inputs locally before one secure evaluation")
+    parser.add_argument("--mux", action="store_true", help="Serve the concurrent circuits of alice --channels")
+    parser.add_argument("--disable-compression", action="store_true", help="Disables payload compression")
+    parser.add_argument("--checkpoint", help="Path of the session checkpoint, resumed if it exists", default=None)
+    parser.add_argument("--checkpoint-interval", help="Number of rounds between two checkpoints", default=DEFAULT_INTERVAL)
+    parser.add_argument("--netem", help="Path to a network profiles file (.json) to emulate a link", default=None)
+    parser.add_argument("--netem-profile", help="Name of the emulated network profile (default: first one)", default=None)
+    parser.add_argument("--circuit-cache", help="Directory keeping the circuits sent by alice for the next sessions", default=None)
+    parser.add_argument("-w", "--workers", help="Number of processes evaluating in parallel (0: inline)", default=0)
+    parser.add_argument("-r", "--raw-log", help="Path for a raw log of the messages, replayable with -e replay://PATH", default=None)
+    parser.add_argument("--metrics", action="store_true", help="Collect and print protocol metrics")
+    parser.add_argument("-m", "--metrics-file", help="Path for metrics export (.json)", default=None)
 
     args = parser.parse_args()
 
@@ -99,8 +348,8 @@ if __name__ == '__main__':
     if not os.path.exists(args.input_file):
         raise FileNotFoundError(f"Input file file not found: {args.input_file}")
 
-    if ".txt" not in args.input_file:
-        raise Exception(f"Input file must be a .txt file: {args.input_file}")
+    if ".txt" not in args.input_file and ".bin" not in args.input_file:
+        raise Exception(f"Input file must be a .txt or .bin file: {args.input_file}")
 
     # Log file
     if ".json" not in args.log_file:
@@ -110,13 +359,55 @@ if __name__ == '__main__':
     if not isinstance(args.disable_ot, bool):
         raise ValueError("Disable oblivious transfer must be of the type bool")
 
-    b = Bob(
+    # Checkpoint
+    if int(args.checkpoint_interval) < 1:
+        raise ValueError("Checkpoint interval must be a positive int")
+
+    # Workers
+    if int(args.workers) < 0:
+        raise ValueError("Number of workers must be a non-negative int")
+
+    # Multiplexing
+    if args.mux and (args.endpoint.startswith("shm://") or args.endpoint.startswith(SCHEME)):
+        raise ValueError("Multiplexing needs a zmq endpoint (tcp://, ipc:// or inproc://)")
+
+    # Network emulation
+    if args.netem is not None and not os.path.exists(args.netem):
+        raise FileNotFoundError(f"Network profiles file not found: {args.netem}")
+
+    # Replay
+    if args.endpoint.startswith(SCHEME) and not os.path.exists(args.endpoint[len(SCHEME):]):
+        raise FileNotFoundError(f"Raw log not found: {args.endpoint[len(SCHEME):]}")
+
+    # Metrics file
+    if args.metrics_file is not None and ".json" not in args.metrics_file:
+        raise Exception(f"Metrics file must be a .json file: {args.metrics_file}")
+
+    b = (MuxBob if args.mux else Bob)(
         oblivious_transfer=not args.disable_ot,
         bit_size=int(args.bit_size),
         inputs_file=args.input_file,
-        logs_file=args.log_file
+        logs_file=args.log_file,
+        metrics=args.metrics or args.metrics_file is not None,
+        endpoint=args.endpoint,
+        aggregate=args.aggregate,
+        compress=not args.disable_compression,
+        checkpoint=args.checkpoint,
+        checkpoint_interval=int(args.checkpoint_interval),
+        netem=netem.load_profile(args.netem, args.netem_profile) if args.netem else None,
+        workers=int(args.workers),
+        raw_log=args.raw_log,
+        circuit_cache=args.circuit_cache
     )
-    b.start()
+    if args.mux:
+        asyncio.run(b.run())
+    else:
+        b.start()
     b.socket.create_logs_file()
     print(f'Computed global max: {b.global_max}')
 
+    if b.metrics.enabled:
+        b.metrics.print_summary()
+    if args.metrics_file:
+        b.metrics.export(args.metrics_file)
+
@@ -1,32 +1,129 @@
+import multiprocessing
+import queue
+import sys
 import threading
-from alice import Alice
-from bob import Bob
+import time
+from functools import partial
+from alice import Alice, AsyncAlice, MuxAlice
+from bob import Bob, AsyncBob, MuxBob
+from src.checkpoint import DEFAULT_INTERVAL
+from src.compare import BACKENDS
+from src.netem import NetemProfile, load_profile
+from src.replay import SCHEME
+from src.util import DEFAULT_ENDPOINT
+import utils
 
 
-def alice_thread(circuits: str, oblivious_transfer: bool, bit_size: int, inputs_file: str, logs_file: str, results):
-    a = Alice(circuits=circuits, oblivious_transfer=oblivious_transfer, bit_size=bit_size, inputs_file=inputs_file, logs_file=logs_file)
+def run_alice(circuits: str, oblivious_transfer: bool, bit_size: int, inputs_file: str, logs_file: str, results,
+              metrics: bool = False, metrics_file: str = None, endpoint: str = DEFAULT_ENDPOINT, aggregate: bool = False,
+              store: str = None, compress: bool = True, checkpoint: str = None, checkpoint_interval: int = DEFAULT_INTERVAL,
+              netem: NetemProfile = None, sequential: bool = False, lazy: bool = False, raw_log: str = None,
+              backend: str = "garbled"):
+    a = Alice(circuits=circuits, oblivious_transfer=oblivious_transfer, bit_size=bit_size, inputs_file=inputs_file, logs_file=logs_file,
+              metrics=metrics, endpoint=endpoint, aggregate=aggregate, store=store, compress=compress, checkpoint=checkpoint,
+              checkpoint_interval=checkpoint_interval, netem=netem, sequential=sequential,
+              lazy=lazy, raw_log=raw_log, backend=backend)
     a.start()
     a.socket.create_logs_file()
     print(f'Alice global max: {a.global_max}')
-    results.append(a.global_max)
+    results.put(("alice", a.global_max))
+    report_metrics(a.metrics, metrics_file)
 
 
-def bob_thread(oblivious_transfer: bool, bit_size: int, inputs_file: str, logs_file: str, results):
-    b = Bob(oblivious_transfer=oblivious_transfer, bit_size=bit_size, inputs_file=inputs_file, logs_file=logs_file)
+def run_bob(oblivious_transfer: bool, bit_size: int, inputs_file: str, logs_file: str, results,
+            metrics: bool = False, metrics_file: str = None, endpoint: str = DEFAULT_ENDPOINT, aggregate: bool = False,
+            compress: bool = True, checkpoint: str = None, checkpoint_interval: int = DEFAULT_INTERVAL,
+            netem: NetemProfile = None, workers: int = 0, raw_log: str = None, circuit_cache: str = None):
+    b = Bob(oblivious_transfer=oblivious_transfer, bit_size=bit_size, inputs_file=inputs_file, logs_file=logs_file,
+            metrics=metrics, endpoint=endpoint, aggregate=aggregate, compress=compress, checkpoint=checkpoint,
+            checkpoint_interval=checkpoint_interval, netem=netem, workers=workers, raw_log=raw_log,
+            circuit_cache=circuit_cache)
     b.start()
     b.socket.create_logs_file()
     print(f'Bob global max: {b.global_max}')
-    results.append(b.global_max)
+    results.put(("bob", b.global_max))
+    report_metrics(b.metrics, metrics_file)
 
 
-def verify(file_path, results, alice_input_file: str, bob_input_file: str):
+async def async_session(alice: AsyncAlice, bob: AsyncBob, results, timeout: float = None):
+    """Run both parties of a session on the current event loop."""
+    import asyncio
+    results.extend(await asyncio.gather(alice.run(timeout), bob.run(timeout)))
+    for party in (alice, bob):
+        party.socket.create_logs_file()
 
-    party_inputs = []
-    with open(alice_input_file, "r") as file:
-        party_inputs += [int(s) for s in file.readline().strip().split(" ")]
 
-    with open(bob_input_file, "r") as file:
-        party_inputs += [int(s) for s in file.readline().strip().split(" ")]
+SUPERVISE_INTERVAL = 0.05  # seconds between two checks of the parties
+
+
+class PartyThread(threading.Thread):
+    """Thread running a party, with the exit code a process would have.
+
+    It is a daemon: once its peer failed, it is left behind when the
+    runner exits (a thread cannot be terminated).
+    """
+    def __init__(self, target, args):
+        super().__init__(target=target, args=args, daemon=True)
+        self.exitcode = None
+
+    def run(self):
+        try:
+            super().run()
+        except BaseException:
+            self.exitcode = 1
+            raise
+        self.exitcode = 0
+
+    def terminate(self):
+        pass
+
+
+def supervise(parties, interval: float = SUPERVISE_INTERVAL):
+    """Wait for the parties of a session (processes or PartyThreads).
+
+    Once a party exits with an error, the other one can only wait for it
+    forever: it is terminated.
+
+    Returns:
+        True if every party completed, False if one failed.
+    """
+    while True:
+        if any(party.exitcode for party in parties if not party.is_alive()):
+            for party in parties:
+                if party.is_alive():
+                    party.terminate()
+            for party in parties:
+                if not isinstance(party, PartyThread):
+                    party.join()
+            return False
+        if not any(party.is_alive() for party in parties):
+            return True
+        time.sleep(interval)
+
+
+def collect(results):
+    """Return the global max of Alice then Bob from a results queue, a
+    party that failed is missing."""
+    maxes = {}
+    while not results.empty():
+        party, global_max = results.get()
+        maxes[party] = global_max
+    return [maxes[party] for party in ("alice", "bob") if party in maxes]
+
+
+def report_metrics(metrics, metrics_file: str = None):
+    if metrics.enabled:
+        metrics.print_summary()
+    if metrics_file:
+        metrics.export(metrics_file)
+
+
+def verify(file_path, results, alice_input_file: str, bob_input_file: str, bit_size: int = 4):
+
+    party_inputs = [
+        utils.load_inputs(alice_input_file, bit_size).max(),
+        utils.load_inputs(bob_input_file, bit_size).max()
+    ]
 
     with open(file_path, 'w') as file:
 
@@ -57,16 +154,42 @@ if __name__ == '__main__':
     parser.add_argument('-ib', '--input_bob', help="Path to bob's input file", default="inputs_bob.txt")
     parser.add_argument('-la', '--log_alice', help="Path to alice's log file", default="logs_alice.json")
     parser.add_argument('-lb', '--log_bob', help="Path to bob's log file", default="logs_bob.json")
+    parser.add_argument('-ra', '--raw_log_alice', help="Path for alice's raw log, replayable with alice.py -e replay://PATH", default=None)
+    parser.add_argument('-rb', '--raw_log_bob', help="Path for bob's raw log, replayable with bob.py -e replay://PATH", default=None)
     parser.add_argument('-v', '--verify', help="Path to verification output file", default="verification.txt")
     parser.add_argument("--disable-ot", action="store_true", help="Disables oblivious transfer")
+    parser.add_argument("-e", "--endpoint", help="Endpoint shared by alice and bob (tcp://, inproc:// or shm://)", default=DEFAULT_ENDPOINT)
+    parser.add_argument("-s", "--store", help="Path to a store of pre-garbled circuits for alice (see src.store)", default=None)
+    parser.add_argument("--aggregate", action="store_true", help="Reduce inputs locally before one secure evaluation")
+    parser.add_argument("--lazy", action="store_true", help="Garble each circuit just before alice uses it")
+    parser.add_argument("--sequential", action="store_true", help="Carry the running max between evaluations as garbled labels")
+    parser.add_argument("--backend", choices=BACKENDS, help="Garbled circuits, or a millionaires' protocol comparing inputs without circuit", default="garbled")
+    parser.add_argument("--circuit-cache", help="Directory where bob keeps the circuits sent by alice for the next sessions", default=None)
+    parser.add_argument("--workers", help="Number of processes evaluating in parallel for bob (0: inline)", default=0)
+    parser.add_argument("--disable-compression", action="store_true", help="Disables payload compression")
+    parser.add_argument('-ca', '--checkpoint_alice', help="Path of alice's session checkpoint, resumed if it exists", default=None)
+    parser.add_argument('-cb', '--checkpoint_bob', help="Path of bob's session checkpoint, resumed if it exists", default=None)
+    parser.add_argument("--checkpoint-interval", help="Number of rounds between two checkpoints", default=DEFAULT_INTERVAL)
+    parser.add_argument("--netem", help="Path to a network profiles file (.json) to emulate a link between alice and bob", default=None)
+    parser.add_argument("--netem-profile", help="Name of the emulated network profile (default: first one)", default=None)
+    parser.add_argument("--asyncio", action="store_true", help="Run alice and bob on one asyncio event loop instead of two processes")
+    parser.add_argument("--threads", action="store_true", help="Run alice and bob as threads of one process instead of two processes")
+    parser.add_argument("--channels", help="Number of circuits run concurrently over one connection (implies --asyncio)", default=0)
+    parser.add_argument("--metrics", action="store_true", help="Collect and print protocol metrics")
+    parser.add_argument('-ma', '--metrics_alice', help="Path for alice's metrics export (.json)", default=None)
+    parser.add_argument('-mb', '--metrics_bob', help="Path for bob's metrics export (.json)", default=None)
 
     args = parser.parse_args()
 
     # Check args
     # Circuit
-    if not os.path.exists(args.circuit):
+    if args.store is None and not os.path.exists(args.circuit):
         raise FileNotFoundError(f"Circuit file not found: {args.circuit}")
 
+    # Store
+    if args.store is not None and not os.path.exists(args.store):
+        raise FileNotFoundError(f"Store not found: {args.store}")
+
     # Bits size for circuit
     if not isinstance(int(args.bit_size), int):
         raise ValueError("Bit size must be of the type int")
@@ -75,14 +198,14 @@ if __name__ == '__main__':
     if not os.path.exists(args.input_alice):
         raise FileNotFoundError(f"Input file file not found: {args.input_alice}")
 
-    if ".txt" not in args.input_alice:
-        raise Exception(f"Input file must be a .txt file: {args.input_alice}")
+    if ".txt" not in args.input_alice and ".bin" not in args.input_alice:
+        raise Exception(f"Input file must be a .txt or .bin file: {args.input_alice}")
 
     if not os.path.exists(args.input_bob):
         raise FileNotFoundError(f"Input file file not found: {args.input_bob}")
 
-    if ".txt" not in args.input_bob:
-        raise Exception(f"Input file must be a .txt file: {args.input_bob}")
+    if ".txt" not in args.input_bob and ".bin" not in args.input_bob:
+        raise Exception(f"Input file must be a .txt or .bin file: {args.input_bob}")
 
     # Log file
     if ".json" not in args.log_alice:
@@ -99,19 +222,107 @@ if __name__ == '__main__':
     if not isinstance(args.disable_ot, bool):
         raise ValueError("Disable oblivious transfer must be of the type bool")
 
+    # Checkpoint
+    if int(args.checkpoint_interval) < 1:
+        raise ValueError("Checkpoint interval must be a positive int")
+
+    # Sequential
+    if args.sequential and (args.store is not None or args.checkpoint_alice is not None):
+        raise ValueError("Sequential circuits are garbled online, without store or checkpoint")
+
+    # Backend
+    if args.backend != "garbled" and (args.store is not None or args.checkpoint_alice is not None or args.sequential):
+        raise ValueError(f"The {args.backend} backend uses no circuit, it has no store, checkpoint or sequential mode")
+
+    if args.backend != "garbled" and (args.asyncio or int(args.channels)):
+        raise ValueError("Asyncio and multiplexed sessions only run the garbled backend")
+
+    # Workers
+    if int(args.workers) < 0:
+        raise ValueError("Number of workers must be a non-negative int")
+
+    # Network emulation
+    if args.netem is not None and not os.path.exists(args.netem):
+        raise FileNotFoundError(f"Network profiles file not found: {args.netem}")
+
+    profile = load_profile(args.netem, args.netem_profile) if args.netem else None
+
+    # Replay
+    if args.endpoint.startswith(SCHEME):
+        raise ValueError("A raw log replays a single party, run alice.py or bob.py with it")
+
+    # Asyncio
+    if int(args.channels) < 0:
+        raise ValueError("Number of channels must be a non-negative int")
+
+    if (args.asyncio or int(args.channels)) and args.endpoint.startswith("shm://"):
+        raise ValueError("Asyncio sessions need a zmq endpoint (tcp://, ipc:// or inproc://)")
+
+    # Processes
+    if not (args.threads or args.asyncio or int(args.channels)) and args.endpoint.startswith("inproc://"):
+        raise ValueError("inproc:// connects threads of one process, use --threads or --asyncio")
+
+    # Metrics
+    for metrics_file in (args.metrics_alice, args.metrics_bob):
+        if metrics_file is not None and ".json" not in metrics_file:
+            raise Exception(f"Metrics file must be a .json file: {metrics_file}")
+
+    alice_metrics = args.metrics or args.metrics_alice is not None
+    bob_metrics = args.metrics or args.metrics_bob is not None
+
     outputs = []
 
-    # Alice
-    # circuits, oblivious_transfer, bit_size, inputs_file, logs_file, results
-    t1 = threading.Thread(target=alice_thread, args=(args.circuit, not args.disable_ot, int(args.bit_size), args.input_alice, args.log_alice, outputs))
+    if args.asyncio or int(args.channels):
+        import asyncio
+        alice_class, bob_class = AsyncAlice, AsyncBob
+        if int(args.channels):  # circuits run concurrently over one connection
+            alice_class, bob_class = partial(MuxAlice, channels=int(args.channels)), MuxBob
+
+        a = alice_class(circuits=args.circuit, oblivious_transfer=not args.disable_ot, bit_size=int(args.bit_size),
+                        inputs_file=args.input_alice, logs_file=args.log_alice, metrics=alice_metrics, endpoint=args.endpoint,
+                        aggregate=args.aggregate, store=args.store, compress=not args.disable_compression,
+                        checkpoint=args.checkpoint_alice, checkpoint_interval=int(args.checkpoint_interval), netem=profile,
+                        sequential=args.sequential, lazy=args.lazy, raw_log=args.raw_log_alice, backend=args.backend)
+        b = bob_class(oblivious_transfer=not args.disable_ot, bit_size=int(args.bit_size), inputs_file=args.input_bob,
+                      logs_file=args.log_bob, metrics=bob_metrics, endpoint=args.endpoint, aggregate=args.aggregate,
+                      compress=not args.disable_compression, checkpoint=args.checkpoint_bob,
+                      checkpoint_interval=int(args.checkpoint_interval), netem=profile, workers=int(args.workers),
+                      raw_log=args.raw_log_bob, circuit_cache=args.circuit_cache)
+        asyncio.run(async_session(a, b, outputs))
+        print(f'Alice global max: {a.global_max}')
+        print(f'Bob global max: {b.global_max}')
+        report_metrics(a.metrics, args.metrics_alice)
+        report_metrics(b.metrics, args.metrics_bob)
+    else:
+        if args.threads:
+            results = queue.SimpleQueue()
+            party_class = PartyThread
+        else:  # one process per party, so they do not share a GIL
+            # spawned as in src.pool, results come back through a pipe
+            context = multiprocessing.get_context("spawn")
+            results = context.SimpleQueue()
+            party_class = context.Process
+
+        # Alice
+        # circuits, oblivious_transfer, bit_size, inputs_file, logs_file, results, metrics, metrics_file, endpoint, aggregate, store,
+        # compress, checkpoint, checkpoint_interval, netem, sequential, lazy, raw_log, backend
+        p1 = party_class(target=run_alice, args=(args.circuit, not args.disable_ot, int(args.bit_size), args.input_alice, args.log_alice, results,
+                                                 alice_metrics, args.metrics_alice, args.endpoint, args.aggregate, args.store,
+                                                 not args.disable_compression, args.checkpoint_alice, int(args.checkpoint_interval),
+                                                 profile, args.sequential, args.lazy, args.raw_log_alice, args.backend))
 
-    # Bob
-    # oblivious_transfer, bit_size, inputs_file, logs_file, results
-    t2 = threading.Thread(target=bob_thread, args=(not args.disable_ot, int(args.bit_size), args.input_bob, args.log_bob, outputs))
+        # Bob
+        # oblivious_transfer, bit_size, inputs_file, logs_file, results, metrics, metrics_file, endpoint, aggregate, compress,
+        # checkpoint, checkpoint_interval, netem, workers, raw_log, circuit_cache
+        p2 = party_class(target=run_bob, args=(not args.disable_ot, int(args.bit_size), args.input_bob, args.log_bob, results,
+                                               bob_metrics, args.metrics_bob, args.endpoint, args.aggregate,
+                                               not args.disable_compression, args.checkpoint_bob, int(args.checkpoint_interval),
+                                               profile, int(args.workers), args.raw_log_bob, args.circuit_cache))
 
-    t1.start()
-    t2.start()
-    t1.join()
-    t2.join()
+        p1.start()
+        p2.start()
+        if not supervise([p1, p2]):
+            sys.exit("A party failed, the session was stopped")
+        outputs = collect(results)
 
-    verify(args.verify, outputs, args.input_alice, args.input_bob)
+    verify(args.verify, outputs, args.input_alice, args.input_bob, int(args.bit_size))
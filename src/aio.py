@@ -0,0 +1,195 @@
+import asyncio
+import pickle
+import zmq
+import zmq.asyncio
+from src import compression, replay
+from src.netem import NetemTransport
+from src.ot import ObliviousTransfer
+from src.transport import ZERO_COPY_THRESHOLD
+from src.util import Socket, LOCAL_PORT, SERVER_HOST, SERVER_PORT
+
+
+class AsyncZmqTransport:
+    """Transport over an asyncio zmq socket.
+
+    All sockets share the process wide asyncio context, so inproc:// endpoints
+    connect sessions driven by the same event loop.
+
+    Args:
+        socket_type: The zmq socket type (e.g. zmq.REQ).
+        endpoint: The zmq endpoint.
+        bind: Bind to the endpoint if True, connect otherwise.
+    """
+    passes_objects = False
+
+    def __init__(self, socket_type, endpoint, bind):
+        self.endpoint = endpoint
+        self.socket = zmq.asyncio.Context.instance().socket(socket_type)
+
+        if bind:
+            self.socket.bind(endpoint)
+        else:
+            self.socket.connect(endpoint)
+
+    async def send(self, frame):
+        await self.socket.send(frame, copy=len(frame) < ZERO_COPY_THRESHOLD)
+
+    async def recv(self):
+        return await self.socket.recv()
+
+    async def poll(self, timeout):
+        return bool(await self.socket.poll(timeout, zmq.POLLIN))
+
+    def close(self):
+        # a cancelled session may leave unsent frames behind, drop them
+        self.socket.close(linger=0)
+
+
+class AsyncNetemTransport(NetemTransport):
+    """NetemTransport over an AsyncZmqTransport, delays do not block the loop."""
+    async def send(self, frame):
+        await asyncio.sleep(self._delay(frame))
+        await self.transport.send(frame)
+
+    async def recv(self):
+        return await self.transport.recv()
+
+    async def poll(self, timeout):
+        return await self.transport.poll(timeout)
+
+
+class AsyncReplayTransport(replay.ReplayTransport):
+    """ReplayTransport awaited by an AsyncSocket."""
+    async def send(self, frame):
+        super().send(frame)
+
+    async def recv(self):
+        return super().recv()
+
+    async def poll(self, timeout):
+        return True
+
+
+class AsyncSocket(Socket):
+    """Socket whose send and receive are coroutines.
+
+    Encoding, compression, logs and metrics are shared with Socket.
+    """
+    @staticmethod
+    def _create_transport(socket_type, endpoint, bind):
+        if endpoint.startswith(replay.SCHEME):
+            return AsyncReplayTransport(endpoint)
+        return AsyncZmqTransport(socket_type, endpoint, bind)
+
+    @staticmethod
+    def _emulate(transport, profile):
+        return AsyncNetemTransport(transport, profile)
+
+    async def send(self, msg):
+        await self.transport.send(self._encode(msg))
+
+    async def receive(self):
+        with self.metrics.timer('network'):
+            frame = await self.transport.recv()
+        return self._decode(frame)
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
+
+    async def negotiate(self):
+        self.codec = compression.by_name(await self.send_wait(self._hello()))
+
+    async def answer(self, hello):
+        name = self._choose_codec(hello)
+        await self.send(name)
+        self.codec = compression.by_name(name)
+
+
+class AsyncEvaluatorSocket(AsyncSocket):
+    def __init__(self, logs_file, endpoint=f"tcp://*:{LOCAL_PORT}", metrics=None, compress=True, netem=None,
+                 raw_log=None):
+        super().__init__(zmq.REP, logs_file, endpoint, bind=True, metrics=metrics, compress=compress,
+                         netem=netem, raw_log=raw_log)
+
+
+class AsyncGarblerSocket(AsyncSocket):
+    def __init__(self, logs_file, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}", metrics=None, compress=True, netem=None,
+                 raw_log=None):
+        super().__init__(zmq.REQ, logs_file, endpoint, bind=False, metrics=metrics, compress=compress,
+                         netem=netem, raw_log=raw_log)
+
+
+class AsyncObliviousTransfer(ObliviousTransfer):
+    """ObliviousTransfer over an AsyncSocket.
+
+    Only the order of messages is repeated here, the cryptography is the
+    one of ObliviousTransfer.
+    """
+    async def get_result(self, a_inputs, b_keys, instance=None):
+        self._log("Sending inputs to Bob")
+        await self.socket.send((a_inputs, instance))
+
+        with self.metrics.timer('ot'):
+            for _ in range(len(b_keys)):
+                w = await self.socket.receive()
+                self._log(f"Received gate ID {w}")
+
+                if self.enabled:
+                    pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
+                    await self.ot_garbler(pair)
+                else:
+                    await self.socket.send((b_keys[w][0], b_keys[w][1]))
+
+        return await self.socket.receive()
+
+    async def send_result(self, circuit, g_tables, pbits_out, b_inputs):
+        a_inputs, instance = await self.socket.receive()
+        b_inputs_encr = {}
+
+        g_tables, pbits_out = self._use_instance(instance, g_tables, pbits_out)
+        self._log("Received Alice's inputs")
+
+        with self.metrics.timer('ot'):
+            for w, b_input in b_inputs.items():
+                self._log(f"Sending gate ID {w}")
+                await self.socket.send(w)
+
+                if self.enabled:
+                    b_inputs_encr[w] = pickle.loads(await self.ot_evaluator(b_input))
+                else:
+                    pair = await self.socket.receive()
+                    self._log(f"Received key pair, key {b_input} selected")
+                    b_inputs_encr[w] = pair[b_input]
+
+        result = self._evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs_encr)
+
+        self._log("Sending circuit evaluation")
+        await self.socket.send(result)
+
+        return result
+
+    async def ot_garbler(self, msgs):
+        self._log("OT protocol started")
+
+        self.metrics.incr('ots')
+        G = self._session_group()
+        await self.socket.send_wait(G)
+
+        c = G.gen_pow(G.rand_int(self.rng))
+        h0 = await self.socket.send_wait(c)
+        await self.socket.send(self._encrypt_pair(G, c, h0, msgs))
+        self._log("OT protocol ended")
+
+    async def ot_evaluator(self, b):
+        self._log("OT protocol started")
+        self.metrics.incr('ots')
+        G = self._session_group(await self.socket.receive())
+        await self.socket.send(True)
+
+        c = await self.socket.receive()
+        x, h_b = self._choose(G, c, b)
+        mb = self._open(G, x, b, await self.socket.send_wait(h_b))
+
+        self._log("OT protocol ended")
+        return mb
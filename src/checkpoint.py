@@ -0,0 +1,64 @@
+import os
+import pickle
+
+DEFAULT_INTERVAL = 100  # rounds between two checkpoints
+
+
+class Checkpoint:
+    """Session state of a party saved to local disk.
+
+    The progress (position in the input schedule, running max, ...) is
+    rewritten every 'interval' rounds. The setup (e.g. Alice's garbled
+    circuits and label seeds) is written once, next to it, with the
+    ".setup" suffix. Files are written atomically and only readable by
+    their owner since the setup holds label seeds.
+
+    Args:
+        path: Path of the checkpoint file.
+        interval: Optional; number of rounds between two checkpoints.
+    """
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.setup_path = path + ".setup"
+        self.interval = interval
+
+    def due(self, rounds_done):
+        """Return True if the state after 'rounds_done' rounds is saved."""
+        return rounds_done % self.interval == 0
+
+    @staticmethod
+    def _write(path, obj):
+        tmp_path = f"{path}.{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)  # a crash never leaves a partial checkpoint
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        self._write(self.path, state)
+
+    def load(self):
+        """Return the last saved state, None if there is none."""
+        return self._read(self.path)
+
+    def save_setup(self, setup):
+        self._write(self.setup_path, setup)
+
+    def load_setup(self):
+        return self._read(self.setup_path)
+
+    def clear(self):
+        """Remove the checkpoint of a completed session."""
+        for path in (self.path, self.setup_path):
+            if os.path.exists(path):
+                os.unlink(path)
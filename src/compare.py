@@ -0,0 +1,174 @@
+import hashlib
+import secrets
+from src.yao import KEY_SIZE
+
+BACKENDS = ("garbled", "millionaires")  # how Alice and Bob compute the max of their inputs
+BLOCK_BITS = 4  # input bits compared by each leaf of the comparison tree
+
+
+class Millionaires:
+    """OT-based millionaires' protocol computing max(a, b), a comparison
+    tree as in CrypTFlow2 (Rathee et al., 2020), instead of a circuit.
+
+    Inputs are split in blocks of 'block_bits' bits, most significant first.
+    For each block Alice offers a table of 2^block_bits entries holding her
+    XOR shares of [a_j > k] and [a_j == k], encrypted under one key per bit
+    of k: Bob obtains the keys of the bits of his block b_j with bit OTs and
+    opens the entry k = b_j. Blocks are then merged pairwise, each merge
+    (gt = gt_hi ^ eq_hi & gt_lo, eq = eq_hi & eq_lo) taking three bit OTs
+    for the AND of shared bits. Alice sends the group elements of the OTs
+    of a level along with the ciphertexts of the previous one, so a
+    comparison takes 1 + log2(blocks) round trips, then Alice reveals her
+    share of [a > b] and the larger input is sent to the other party.
+
+    Both parties learn max(a, b), as with a max circuit. The OTs are those
+    of ObliviousTransfer, batched: with OT disabled the pairs are sent in
+    clear.
+
+    Args:
+        ot: The ObliviousTransfer of the party.
+        bit_size: Number of bits of the inputs.
+        block_bits: Optional; number of bits of a block (BLOCK_BITS by default).
+    """
+    def __init__(self, ot, bit_size, block_bits=BLOCK_BITS):
+        self.ot = ot
+        self.socket = ot.socket
+        self.metrics = ot.metrics
+        self.bit_size = bit_size
+        self.block_bits = block_bits
+        self.blocks = -(-bit_size // block_bits)
+        # seeded with the OTs when the session is recorded (see src.replay)
+        self.random = ot.rng or secrets.SystemRandom()
+
+    def garbler_max(self, a):
+        """Compare Alice's input with Bob's and return the max (Alice's side)."""
+        G = self.ot._session_group() if self.ot.enabled else None
+        shares, tables, pairs = [], [], []
+        for a_j in self._split(a):
+            share, table, keys = self._leaf(a_j)
+            shares.append(share)
+            tables.append(table)
+            pairs.extend(keys)
+
+        cs = self._offer(G, len(pairs))
+        hs = self.socket.send_wait({"group": G, "c": cs})
+        message = {"tables": tables}  # sent with the keys to open them
+
+        while len(shares) > 1:
+            encrypted = self._encrypt(G, cs, hs, pairs)
+            shares, pairs = self._merge_garbler(shares)
+            cs = self._offer(G, len(pairs))
+            hs = self.socket.send_wait({**message, "ots": encrypted, "c": cs})
+            message = {}
+
+        reply = self.socket.send_wait({**message, "ots": self._encrypt(G, cs, hs, pairs), "share": shares[0][0]})
+        if reply is None:  # a > b, Bob learns a
+            self.socket.send_wait(a)
+            return a
+        return reply
+
+    def evaluator_max(self, b):
+        """Compare Bob's input with Alice's and return the max (Bob's side)."""
+        message = self.socket.receive()
+        G = self.ot._session_group(message["group"]) if self.ot.enabled else None
+        choices = [(b_j >> t) & 1 for b_j in self._split(b) for t in range(self.block_bits)]
+
+        xs, hs = self._choose(G, message["c"], choices)
+        self.socket.send(hs)
+        message = self.socket.receive()
+        keys = self._open(G, xs, choices, message["ots"])
+        shares = [self._open_leaf(b_j, table, keys[j * self.block_bits:(j + 1) * self.block_bits])
+                  for j, (b_j, table) in enumerate(zip(self._split(b), message["tables"]))]
+
+        while len(shares) > 1:
+            choices = [bit for hi, lo in zip(shares[0::2], shares[1::2]) for bit in (lo[0], lo[1], hi[1])]
+            xs, hs = self._choose(G, message["c"], choices)
+            self.socket.send(hs)
+            message = self.socket.receive()
+            shares = self._merge_evaluator(shares, self._open(G, xs, choices, message["ots"]))
+
+        if shares[0][0] ^ message["share"]:  # a > b
+            self.socket.send(None)
+            a = self.socket.receive()
+            self.socket.send(True)
+            return a
+        self.socket.send(b)
+        return b
+
+    def _split(self, value):
+        """Return the blocks of an input, most significant first."""
+        mask = (1 << self.block_bits) - 1
+        return [(value >> (self.block_bits * j)) & mask for j in range(self.blocks - 1, -1, -1)]
+
+    def _leaf(self, a_j):
+        """Return Alice's shares (gt, eq) of a block, the encrypted table
+        of Bob's shares and the key pairs of its bits."""
+        gt, eq = self.random.getrandbits(1), self.random.getrandbits(1)
+        keys = [(self.random.randbytes(KEY_SIZE), self.random.randbytes(KEY_SIZE)) for _ in range(self.block_bits)]
+        table = bytes(
+            ((gt ^ (a_j > k)) | (eq ^ (a_j == k)) << 1) ^ self._pad([keys[t][(k >> t) & 1] for t in range(self.block_bits)])
+            for k in range(1 << self.block_bits)
+        )
+        return (gt, eq), table, keys
+
+    def _open_leaf(self, b_j, table, keys):
+        entry = table[b_j] ^ self._pad(keys)
+        return entry & 1, entry >> 1
+
+    @staticmethod
+    def _pad(keys):
+        return hashlib.shake_256(b"".join(keys)).digest(1)[0]
+
+    def _merge_garbler(self, shares):
+        """Merge pairs of blocks: return Alice's shares of the next level
+        and the pairs offered for the ANDs with Bob's shares."""
+        merged, pairs = [], []
+        for (gt_hi, eq_hi), (gt_lo, eq_lo) in zip(shares[0::2], shares[1::2]):
+            r1, r2, s = self.random.getrandbits(1), self.random.getrandbits(1), self.random.getrandbits(2)
+            pairs.append((bytes((r1, )), bytes((r1 ^ eq_hi, ))))  # Bob's gt_lo times eq_hi
+            pairs.append((bytes((r2, )), bytes((r2 ^ eq_hi, ))))  # Bob's eq_lo times eq_hi
+            pairs.append((bytes((s, )), bytes((s ^ (gt_lo | eq_lo << 1), ))))  # Bob's eq_hi times gt_lo, eq_lo
+            merged.append((gt_hi ^ (eq_hi & gt_lo) ^ r1 ^ (s & 1), (eq_hi & eq_lo) ^ r2 ^ (s >> 1)))
+        if len(shares) % 2:
+            merged.append(shares[-1])
+        return merged, pairs
+
+    @staticmethod
+    def _merge_evaluator(shares, received):
+        merged = []
+        for i, ((gt_hi, eq_hi), (gt_lo, eq_lo)) in enumerate(zip(shares[0::2], shares[1::2])):
+            o1, o2, o3 = (received[3 * i + k][0] for k in range(3))
+            merged.append((gt_hi ^ (eq_hi & gt_lo) ^ o1 ^ (o3 & 1), (eq_hi & eq_lo) ^ o2 ^ (o3 >> 1)))
+        if len(shares) % 2:
+            merged.append(shares[-1])
+        return merged
+
+    def _offer(self, G, count):
+        """Return Alice's group elements c of a batch of OTs."""
+        if not self.ot.enabled:
+            return None
+        return [G.gen_pow(G.rand_int(self.ot.rng)) for _ in range(count)]
+
+    def _encrypt(self, G, cs, hs, pairs):
+        """Return Alice's pairs encrypted for Bob's public keys."""
+        self.metrics.incr('ots', len(pairs))
+        if not self.ot.enabled:
+            return pairs
+        with self.metrics.timer('ot'):
+            return [self.ot._encrypt_pair(G, c, h, pair) for c, h, pair in zip(cs, hs, pairs)]
+
+    def _choose(self, G, cs, choices):
+        """Return Bob's secrets and public keys for a batch of OTs."""
+        if not self.ot.enabled:
+            return None, None
+        with self.metrics.timer('ot'):
+            chosen = [self.ot._choose(G, c, b) for c, b in zip(cs, choices)]
+        return [x for x, _ in chosen], [h for _, h in chosen]
+
+    def _open(self, G, xs, choices, encrypted):
+        """Return the messages selected by Bob."""
+        self.metrics.incr('ots', len(choices))
+        if not self.ot.enabled:
+            return [pair[b] for pair, b in zip(encrypted, choices)]
+        with self.metrics.timer('ot'):
+            return [self.ot._open(G, x, b, e) for x, b, e in zip(xs, choices, encrypted)]
@@ -0,0 +1,104 @@
+import zlib
+
+RAW = 0  # frame header of an uncompressed payload
+THRESHOLD = 1024  # frames below this size (bytes) are never compressed
+SAMPLE_SIZE = 4096  # size of the probe taken from large frames
+MIN_SAVING = 0.05  # compress only if it saves at least 5%
+
+
+class Codec:
+    """A compression codec identified by a one byte frame header."""
+    def __init__(self, name, header, compress, decompress):
+        self.name = name
+        self.header = header
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _zstd():
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=3)
+    decompressor = zstandard.ZstdDecompressor()
+    return Codec("zstd", 2, compressor.compress, decompressor.decompress)
+
+
+def _lz4():
+    import lz4.frame
+    return Codec("lz4", 3, lz4.frame.compress, lz4.frame.decompress)
+
+
+def _zlib():
+    return Codec("zlib", 1, lambda data: zlib.compress(data, 1), zlib.decompress)
+
+
+_FACTORIES = (_zstd, _lz4, _zlib)  # in order of preference
+_codecs = None
+
+
+def codecs():
+    """Return the available codecs in order of preference, importing the
+    optional zstd and lz4 bindings on first use."""
+    global _codecs
+    if _codecs is None:
+        _codecs = []
+        for factory in _FACTORIES:
+            try:
+                _codecs.append(factory())
+            except ImportError:
+                pass
+    return _codecs
+
+
+def by_name(name):
+    for codec in codecs():
+        if codec.name == name:
+            return codec
+    return None
+
+
+def by_header(header):
+    for codec in codecs():
+        if codec.header == header:
+            return codec
+    raise ValueError(f"Unsupported compression header: {header}")
+
+
+def choose(offer):
+    """Return the name of the preferred codec among the names offered."""
+    for codec in codecs():
+        if codec.name in offer:
+            return codec.name
+    return None
+
+
+def _worth_it(codec, data):
+    return len(codec.compress(data)) <= len(data) * (1 - MIN_SAVING)
+
+
+def encode(codec, payload, metrics):
+    """Prefix a payload with its header, compressing it with 'codec' when
+    it is large enough and compressible (ciphertext is not)."""
+    if codec is None or len(payload) < THRESHOLD:
+        return bytes((RAW, )) + payload
+
+    # probe a sample first so large ciphertext frames are skipped cheaply
+    if len(payload) > 2 * SAMPLE_SIZE and not _worth_it(codec, payload[:SAMPLE_SIZE]):
+        metrics.incr('compression_skipped')
+        return bytes((RAW, )) + payload
+
+    packed = codec.compress(payload)
+    if len(packed) > len(payload) * (1 - MIN_SAVING):
+        metrics.incr('compression_skipped')
+        return bytes((RAW, )) + payload
+
+    metrics.incr('frames_compressed')
+    metrics.incr('bytes_saved', len(payload) - len(packed))
+    return bytes((codec.header, )) + packed
+
+
+def decode(frame):
+    """Return the payload of a frame, decompressing it if needed."""
+    view = memoryview(frame)
+    if view[0] == RAW:
+        return view[1:]
+    return by_header(view[0]).decompress(view[1:])
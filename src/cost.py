@@ -0,0 +1,282 @@
+import json
+import pickle
+import time
+from src import util, yao
+from src.garbler import YaoGarbler
+from src.netem import load_profile
+
+FREE_GATES = ("XOR", "XNOR", "NOT")  # gates without a table under free-XOR
+DEFAULT_ROUND_TRIP_SECONDS = 2e-4  # local cost of a round trip over loopback, see calibrate
+SESSION_ROUND_TRIPS = 2  # compression hello and exit
+TIMING_RUNS = 20  # evaluations timed to measure the evaluation cost of a circuit
+
+
+def analyze(circuit):
+    """Return the structure of a circuit.
+
+    Returns:
+        A dict with the gate count by type, the number of free gates (under
+        free-XOR) and non-free ones, the depth and the width of each level.
+    """
+    level = {w: 0 for w in circuit.get("alice", []) + circuit.get("bob", [])}
+    types = {}
+    widths = []
+
+    for gate in sorted(circuit["gates"], key=lambda g: g["id"]):  # evaluation order, as in yao.compile_circuit
+        depth = 1 + max(level.get(w, 0) for w in gate["in"])
+        level[gate["id"]] = depth
+        types[gate["type"]] = types.get(gate["type"], 0) + 1
+        if depth > len(widths):
+            widths.append(0)
+        widths[depth - 1] += 1
+
+    free = sum(count for gate_type, count in types.items() if gate_type in FREE_GATES)
+    return {
+        "gates": len(circuit["gates"]),
+        "types": types,
+        "free": free,
+        "non_free": len(circuit["gates"]) - free,
+        "depth": len(widths),
+        "widths": widths,
+    }
+
+
+def table_bytes(structure, garbled_tables):
+    """Return the bytes of the garbled tables of a circuit for each scheme.
+
+    "classic" is the scheme of src.yao (AES-CTR double encryption of each
+    row, with IVs and padding), measured on a garbled instance. The others
+    are the textbook sizes of the schemes src.yao does not implement.
+    """
+    not_gates = structure["types"].get("NOT", 0)
+    rows = 4 * (structure["gates"] - not_gates) + 2 * not_gates
+    return {
+        "classic": len(pickle.dumps(garbled_tables, pickle.DEFAULT_PROTOCOL)),
+        "point-and-permute": rows * yao.KEY_SIZE,
+        "free-xor": 4 * structure["non_free"] * yao.KEY_SIZE,
+        "half-gates": 2 * structure["non_free"] * yao.KEY_SIZE,
+    }
+
+
+def _frame(msg):
+    return 1 + len(pickle.dumps(msg, pickle.DEFAULT_PROTOCOL))  # header byte + payload
+
+
+def _inputs(entry, wires):
+    keys, pbits = entry["keys"], entry["pbits"]
+    return {w: (keys[w][0], pbits[w]) for w in wires}  # labels of bits 0
+
+
+def _exchanges(circuit, entry, oblivious_transfer, fresh):
+    """Return the frames of one evaluation as (Alice's bytes, Bob's bytes,
+    round trips), rebuilt from a garbled instance as ObliviousTransfer
+    sends them."""
+    keys = entry["keys"]
+    a_inputs = _inputs(entry, circuit.get("alice", []))
+    b_inputs = _inputs(entry, circuit.get("bob", []))
+    instance = {"garbled_tables": entry["garbled_tables"], "pbits_out": entry["pbits_out"]} if fresh else None
+    sent, received = _frame((a_inputs, instance)), 0
+
+    G = util.PrimeGroup()
+    label = pickle.dumps(keys[circuit["out"][0]][0])
+    for w in circuit.get("bob", []):
+        received += _frame(w)
+        if oblivious_transfer:  # group, c, (c1, e0, e1) against an ack and h
+            sent += _frame(G) + _frame(G.gen_pow(G.rand_int())) + _frame((G.gen_pow(G.rand_int()), label, label))
+            received += _frame(True) + _frame(G.gen_pow(G.rand_int()))
+        else:
+            sent += _frame((keys[w][0], keys[w][1]))
+
+    received += _frame(yao.evaluate(circuit, entry["garbled_tables"], entry["pbits_out"], a_inputs, b_inputs))
+    round_trips = 1 + len(circuit.get("bob", [])) * (3 if oblivious_transfer else 1)
+    return sent, received, round_trips
+
+
+def evaluation_seconds(circuit, entry, runs=TIMING_RUNS):
+    """Measure the seconds taken by one evaluation of a garbled circuit."""
+    a_inputs = _inputs(entry, circuit.get("alice", []))
+    b_inputs = _inputs(entry, circuit.get("bob", []))
+    yao.compile_circuit(circuit)  # compiled once per session
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        yao.evaluate(circuit, entry["garbled_tables"], entry["pbits_out"], a_inputs, b_inputs)
+    return (time.perf_counter() - start) / runs
+
+
+def estimate(circuits, pairs, oblivious_transfer=True, fresh=False, round_trip_seconds=DEFAULT_ROUND_TRIP_SECONDS,
+             profile=None, cached=False):
+    """Estimate the cost of a session before running it.
+
+    Args:
+        circuits: Path to a circuits file (as for Alice).
+        pairs: Number of input pairs, i.e. evaluations of each circuit.
+        oblivious_transfer: Optional; estimate with OT (True by default).
+        fresh: Optional; a fresh garbled instance is sent for each
+            evaluation (store or sequential mode).
+        round_trip_seconds: Optional; local cost of a round trip, see
+            calibrate.
+        profile: Optional; a NetemProfile of the link, a local link if None.
+        cached: Optional; Bob has the circuits in his topology cache (see
+            src.topology), Alice only sends their hash.
+
+    Returns:
+        A dict with the cost of each circuit and the totals of the session.
+    """
+    rtt = profile.rtt_ms / 1000 if profile else 0.0
+    reports = []
+    total = {"evaluations": 0, "ots": 0, "round_trips": SESSION_ROUND_TRIPS, "bytes": 0, "seconds": 0.0}
+
+    for circuit in util.parse_json(circuits)["circuits"]:
+        structure = analyze(circuit)
+        entry = YaoGarbler.entry(circuit, yao.GarbledCircuit(circuit))
+        tables = table_bytes(structure, entry["garbled_tables"])
+        sent, received, round_trips = _exchanges(circuit, entry, oblivious_transfer, fresh)
+        seconds = evaluation_seconds(circuit, entry)
+
+        # the circuit message carries the first instance, the spec follows if Bob misses it
+        setup_bytes = _frame({"circuit": None, "hash": yao.circuit_hash(circuit),
+                              "garbled_tables": entry["garbled_tables"], "pbits_out": entry["pbits_out"]})
+        setup_round_trips = 1
+        if not cached:
+            setup_bytes += _frame({"missing": True}) + _frame(circuit)
+            setup_round_trips += 1
+        circuit_bytes = setup_bytes + pairs * (sent + received)
+        circuit_round_trips = setup_round_trips + pairs * round_trips
+        transmit = profile.transmit_time(circuit_bytes) if profile else 0.0
+        circuit_seconds = (circuit_round_trips * (rtt + round_trip_seconds) + transmit + pairs * seconds)
+
+        reports.append({
+            "id": circuit["id"],
+            "structure": structure,
+            "table_bytes": tables,
+            "per_evaluation": {
+                "ots": len(circuit.get("bob", [])) if oblivious_transfer else 0,
+                "round_trips": round_trips,
+                "bytes_sent": sent,
+                "bytes_received": received,
+                "evaluation_seconds": seconds,
+            },
+            "total": {
+                "evaluations": pairs,
+                "round_trips": circuit_round_trips,
+                "bytes": circuit_bytes,
+                "seconds": circuit_seconds,
+            },
+        })
+        total["evaluations"] += pairs
+        total["ots"] += pairs * reports[-1]["per_evaluation"]["ots"]
+        total["round_trips"] += circuit_round_trips
+        total["bytes"] += circuit_bytes
+        total["seconds"] += circuit_seconds
+
+    total["seconds"] += SESSION_ROUND_TRIPS * (rtt + round_trip_seconds)
+    return {
+        "profile": profile.to_json() if profile else None,
+        "round_trip_seconds": round_trip_seconds,
+        "circuits": reports,
+        "total": total,
+    }
+
+
+def calibrate(results_path):
+    """Return the local cost of a round trip fitted on benchmark results.
+
+    The runtime of each run (see benchmark.py) left once the emulated link
+    and the evaluations are accounted for is spread over its round trips
+    (serialization, OT exponentiations, scheduling).
+
+    Args:
+        results_path: Path of the results of benchmark.py (-o).
+    """
+    with open(results_path) as file:
+        results = json.load(file)
+
+    circuits = util.parse_json(results["circuit"])["circuits"]
+    seconds = 0.0
+    for circuit in circuits:
+        seconds += evaluation_seconds(circuit, YaoGarbler.entry(circuit, yao.GarbledCircuit(circuit)))
+    seconds /= len(circuits)
+
+    samples = []
+    for run in results["runs"]:
+        counters = run["alice"]["counters"]
+        round_trips = counters.get("round_trips", 0)
+        if not round_trips:
+            continue
+        profile = run["profile"] or {"rtt_ms": 0, "bandwidth_mbps": None}
+        link = round_trips * profile["rtt_ms"] / 1000
+        if profile.get("bandwidth_mbps"):
+            size = counters.get("bytes_sent", 0) + counters.get("bytes_received", 0)
+            link += size * 8 / (profile["bandwidth_mbps"] * 1e6)
+        evaluations = run["alice"]["histograms"].get("evaluation_latency", {}).get("count", 0)
+        samples.append(max(0.0, run["seconds"] - link - evaluations * seconds) / round_trips)
+
+    if not samples:
+        raise ValueError(f"No run with round trips in {results_path}")
+    return sum(samples) / len(samples)
+
+
+def print_estimate(report):
+    for circuit in report["circuits"]:
+        structure, per_evaluation, total = circuit["structure"], circuit["per_evaluation"], circuit["total"]
+        print(f"======== {circuit['id']} ========")
+        print(f"  gates {structure['gates']} (free {structure['free']}, non-free {structure['non_free']})  "
+              + "  ".join(f"{t} {n}" for t, n in sorted(structure["types"].items())))
+        print(f"  depth {structure['depth']}  widths {structure['widths']}")
+        print("  tables " + "  ".join(f"{scheme} {size} B" for scheme, size in circuit["table_bytes"].items()))
+        print(f"  per evaluation: ots {per_evaluation['ots']}  round trips {per_evaluation['round_trips']}  "
+              f"bytes {per_evaluation['bytes_sent']} + {per_evaluation['bytes_received']}  "
+              f"evaluation {per_evaluation['evaluation_seconds'] * 1000:.3f} ms")
+        print(f"  {total['evaluations']} evaluations: round trips {total['round_trips']}  "
+              f"bytes {total['bytes']}  runtime {total['seconds']:.3f} s")
+    total = report["total"]
+    print("======== total ========")
+    print(f"  evaluations {total['evaluations']}  ots {total['ots']}  round trips {total['round_trips']}  "
+          f"bytes {total['bytes']}  runtime {total['seconds']:.3f} s "
+          f"({report['round_trip_seconds'] * 1000:.3f} ms per round trip)")
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(prog="Yao Protocol - cost",
+                                     description="Estimate the cost of a session before running it")
+    parser.add_argument("-c", "--circuit", help="Path to circuit file", default="4bit_max.json")
+    parser.add_argument("-n", "--pairs", help="Number of input pairs to evaluate", default=1)
+    parser.add_argument("--disable-ot", action="store_true", help="Estimate without oblivious transfer")
+    parser.add_argument("--fresh", action="store_true", help="A fresh garbled instance per evaluation (store, sequential)")
+    parser.add_argument("--cached", action="store_true", help="Bob has the circuits cached (bob.py --circuit-cache)")
+    parser.add_argument("--calibration", help="Path to benchmark results (.json) to calibrate the round trip cost", default=None)
+    parser.add_argument("--netem", help="Path to a network profiles file (.json)", default=None)
+    parser.add_argument("--netem-profile", help="Name of the network profile (default: first one)", default=None)
+    parser.add_argument("-o", "--output", help="Path for the estimate (.json)", default=None)
+
+    args = parser.parse_args()
+
+    # Check args
+    for path in (args.circuit, args.calibration, args.netem):
+        if path is not None and not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+
+    if int(args.pairs) < 1:
+        raise ValueError("Number of input pairs must be a positive int")
+
+    if args.output is not None and ".json" not in args.output:
+        raise Exception(f"Output file must be a .json file: {args.output}")
+
+    report = estimate(
+        args.circuit,
+        int(args.pairs),
+        oblivious_transfer=not args.disable_ot,
+        fresh=args.fresh,
+        round_trip_seconds=calibrate(args.calibration) if args.calibration else DEFAULT_ROUND_TRIP_SECONDS,
+        profile=load_profile(args.netem, args.netem_profile) if args.netem else None,
+        cached=args.cached,
+    )
+    print_estimate(report)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(json.dumps(report, indent=4))
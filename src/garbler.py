@@ -1,31 +1,120 @@
+import itertools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from src import ot, util, yao
+from src.metrics import NULL_METRICS
 from abc import ABC, abstractmethod
 
-logging.basicConfig(format="[%(levelname)s] %(message)s",
-                    level=logging.WARNING)
-
 
 class YaoGarbler(ABC):
-    """An abstract class for Yao garblers (e.g. Alice)."""
-    def __init__(self, circuits):
+    """An abstract class for Yao garblers (e.g. Alice).
+
+    Circuits are either garbled at startup from the circuits file or, with a
+    store, streamed out of instances garbled ahead of time (see src.store).
+    A resumed session restores its garbled circuits from the setup of a
+    checkpoint (see src.checkpoint) instead.
+
+    With lazy garbling, each circuit is garbled when it is first used while
+    the next one is garbled in the background, and is released once done.
+    """
+    def __init__(self, circuits, metrics=NULL_METRICS, store=None, garbled=None, lazy=False):
+        self.store = None
+        self.lazy = lazy
+        self.metrics = metrics
+
+        if store is not None:
+            from src.store import GarbledStore
+            self.store = GarbledStore(store)
+            self.name = self.store.name
+            self.circuits = [{"circuit": circuit, "index": i}
+                             for i, circuit in enumerate(self.store.circuits)]
+            return
+
         circuits = util.parse_json(circuits)
         self.name = circuits["name"]
         self.circuits = []
 
+        if lazy:
+            self.circuits = [{"circuit": circuit, "index": i}
+                             for i, circuit in enumerate(circuits["circuits"])]
+            self._prefetch = {}  # index -> future of a garbled entry
+            self._executor = None
+            return
+
+        if garbled is not None:
+            for circuit, saved in zip(circuits["circuits"], garbled):
+                keys, pbits = yao.derive_labels(circuit, saved["seed"])
+                self.circuits.append({
+                    "circuit": circuit,
+                    "garbled_tables": saved["garbled_tables"],
+                    "keys": keys,
+                    "pbits": pbits,
+                    "pbits_out": saved["pbits_out"],
+                    "seed": saved["seed"],
+                })
+            return
+
         for circuit in circuits["circuits"]:
-            garbled_circuit = yao.GarbledCircuit(circuit)
-            pbits = garbled_circuit.get_pbits()
-            entry = {
-                "circuit": circuit,
-                "garbled_circuit": garbled_circuit,
-                "garbled_tables": garbled_circuit.get_garbled_tables(),
-                "keys": garbled_circuit.get_keys(),
-                "pbits": pbits,
-                "pbits_out": {w: pbits[w]
-                              for w in circuit["out"]},
-            }
-            self.circuits.append(entry)
+            garbled_circuit = yao.GarbledCircuit(circuit, metrics=metrics)
+            self.circuits.append(self.entry(circuit, garbled_circuit))
+
+    @staticmethod
+    def entry(circuit, garbled_circuit):
+        """Return the dict representing a garbled circuit."""
+        pbits = garbled_circuit.get_pbits()
+        return {
+            "circuit": circuit,
+            "garbled_circuit": garbled_circuit,
+            "garbled_tables": garbled_circuit.get_garbled_tables(),
+            "keys": garbled_circuit.get_keys(),
+            "pbits": pbits,
+            "pbits_out": {w: pbits[w]
+                          for w in circuit["out"]},
+            "seed": garbled_circuit.seed,
+        }
+
+    def instances(self, entry, start=0):
+        """Iterate over the garbled instances to use for a circuit, one per
+        evaluation: fresh instances from the store, or the garbled circuit
+        of the entry reused for every evaluation.
+
+        Args:
+            entry: A dict representing the circuit.
+            start: Optional; index of the first store instance to use.
+        """
+        if self.store is not None:
+            return self.store.instances(entry["index"], start)
+        if self.lazy:
+            return itertools.repeat(self._garble(entry["index"]))
+        return itertools.repeat(entry)
+
+    def _garble(self, index):
+        """Return the garbled entry of a circuit and start garbling the next
+        one in the background."""
+        future = self._prefetch.pop(index, None)
+        entry = future.result() if future else self._garble_circuit(index)
+
+        if index + 1 < len(self.circuits):
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._prefetch[index + 1] = self._executor.submit(self._garble_circuit, index + 1)
+        return entry
+
+    def _garble_circuit(self, index):
+        circuit = self.circuits[index]["circuit"]
+        return self.entry(circuit, yao.GarbledCircuit(circuit, metrics=self.metrics))
+
+    def garbled(self):
+        """Return what restores the garbled circuits of this garbler (see
+        the 'garbled' argument), None with a store or lazy garbling: each
+        circuit is garbled again and sent on resume."""
+        if self.store is not None or self.lazy:
+            return None
+        return [{
+            "garbled_tables": entry["garbled_tables"],
+            "pbits_out": entry["pbits_out"],
+            "seed": entry["seed"],
+        } for entry in self.circuits]
 
     @abstractmethod
     def start(self):
@@ -255,7 +344,7 @@ def main(
     print_mode="circuit",
     loglevel=logging.WARNING,
 ):
-    logging.getLogger().setLevel(loglevel)
+    logging.basicConfig(format="[%(levelname)s] %(message)s", level=loglevel)
 
     if party == "alice":
         alice = Alice(circuit_path, oblivious_transfer=oblivious_transfer)
@@ -0,0 +1,174 @@
+import json
+import time
+
+
+class Histogram:
+    """A constant-memory histogram with exponentially sized buckets.
+
+    Args:
+        base: Upper bound of the first bucket (seconds).
+        buckets: Number of buckets, each twice as wide as the previous one.
+    """
+    def __init__(self, base=1e-6, buckets=32):
+        self.bounds = [base * 2**i for i in range(buckets)]
+        self.counts = [0] * (buckets + 1)  # last bucket catches overflow
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Record a single observation."""
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, p):
+        """Estimate the p-th percentile from the bucket upper bounds."""
+        if not self.count:
+            return None
+
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class _Timer:
+    """Context manager adding the elapsed time of a block to a phase."""
+    __slots__ = ("metrics", "phase", "start")
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.phase, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Collects per-phase timers, protocol counters and latency histograms.
+
+    Phases used by the protocol are "garble", "ot", "evaluate", "serialize"
+    and "network" (time spent waiting on the other party).
+
+    Args:
+        name: Label used in the printed summary (e.g. "alice").
+    """
+    enabled = True
+
+    def __init__(self, name=""):
+        self.name = name
+        self.timers = {}  # phase -> [calls, total seconds]
+        self.counters = {}  # counter -> value
+        self.histograms = {}  # name -> Histogram
+
+    def timer(self, phase):
+        """Return a context manager timing a block as part of 'phase'."""
+        return _Timer(self, phase)
+
+    def add_time(self, phase, seconds):
+        entry = self.timers.get(phase)
+        if entry is None:
+            self.timers[phase] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def incr(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def observe(self, histogram, value):
+        if histogram not in self.histograms:
+            self.histograms[histogram] = Histogram()
+        self.histograms[histogram].observe(value)
+
+    def summary(self):
+        """Return all collected metrics as a JSON serializable dict."""
+        return {
+            'name': self.name,
+            'timers': {
+                phase: {'calls': calls, 'seconds': seconds}
+                for phase, (calls, seconds) in self.timers.items()
+            },
+            'counters': dict(self.counters),
+            'histograms': {k: v.to_json() for k, v in self.histograms.items()},
+        }
+
+    def print_summary(self):
+        print(f"======== metrics {self.name} ========")
+        for phase, (calls, seconds) in sorted(self.timers.items()):
+            print(f"  {phase:<24} {seconds * 1000:12.3f} ms  ({calls} calls)")
+        for counter, value in sorted(self.counters.items()):
+            print(f"  {counter:<24} {value:12}")
+        for name, histogram in sorted(self.histograms.items()):
+            h = histogram.to_json()
+            if h['count']:
+                print(f"  {name:<24} n={h['count']} mean={h['mean'] * 1000:.3f} ms "
+                      f"p50<={h['p50'] * 1000:.3f} ms p99<={h['p99'] * 1000:.3f} ms "
+                      f"max={h['max'] * 1000:.3f} ms")
+        print()
+
+    def export(self, file_path):
+        """Write the summary to a JSON file."""
+        with open(file_path, 'w') as file:
+            file.write(json.dumps(self.summary(), indent=4))
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullMetrics(Metrics):
+    """Disabled metrics: every call is a no-op."""
+    enabled = False
+    _timer = _NullTimer()
+
+    def timer(self, phase):
+        return self._timer
+
+    def add_time(self, phase, seconds):
+        pass
+
+    def incr(self, counter, value=1):
+        pass
+
+    def observe(self, histogram, value):
+        pass
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,154 @@
+import asyncio
+import collections
+import struct
+import zmq
+import zmq.asyncio
+from src.aio import AsyncSocket
+from src.transport import ZERO_COPY_THRESHOLD
+
+CONTROL = 0  # channel of the connection itself, opened last to close it
+CHANNEL = struct.Struct("<I")  # channel id prefixed to each frame
+LINGER_MS = 1000  # time left to send the last frames when closing
+POLL_INTERVAL = 1e-3  # seconds between two checks of an empty inbox
+
+
+class Multiplexer:
+    """Logical channels over one connection (zmq PAIR socket).
+
+    Each frame is sent as [channel id, payload]. A reader task routes the
+    received frames to the inbox of their channel. Sends are queued in the
+    outbox of their channel and a writer task takes one frame of each
+    channel in turn, so a busy channel does not hold back the others. The
+    first frame of a channel announces it to the receiving side (see
+    accept). Tasks start on first use, from the event loop.
+
+    Args:
+        endpoint: A zmq endpoint (tcp://, ipc:// or inproc://).
+        bind: Bind to the endpoint if True, connect otherwise.
+    """
+    def __init__(self, endpoint, bind):
+        self.endpoint = endpoint
+        self.socket = zmq.asyncio.Context.instance().socket(zmq.PAIR)
+
+        if bind:
+            self.socket.bind(endpoint)
+        else:
+            self.socket.connect(endpoint)
+
+        self.inboxes = {}  # channel -> asyncio.Queue of received frames
+        self.outboxes = {}  # channel -> deque of frames to send
+        self.opened = asyncio.Queue()  # channels announced by the peer, in order
+        self._announced = set()
+        self._wakeup = asyncio.Event()  # a frame was queued
+        self._drained = asyncio.Event()  # all outboxes are empty
+        self._drained.set()
+        self._tasks = []
+
+    def _start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._read()), loop.create_task(self._write())]
+
+    def _inbox(self, channel):
+        if channel not in self.inboxes:
+            self.inboxes[channel] = asyncio.Queue()
+            self.outboxes[channel] = collections.deque()
+        return self.inboxes[channel]
+
+    async def _read(self):
+        while True:
+            header, frame = await self.socket.recv_multipart()
+            channel, = CHANNEL.unpack(header)
+            self._inbox(channel).put_nowait(frame)
+            if channel not in self._announced:
+                self._announced.add(channel)
+                self.opened.put_nowait(channel)
+
+    async def _write(self):
+        while True:
+            sent = False
+            for channel, outbox in list(self.outboxes.items()):  # one frame per channel and turn
+                if outbox:
+                    frame = outbox.popleft()
+                    await self.socket.send_multipart([CHANNEL.pack(channel), frame],
+                                                     copy=len(frame) < ZERO_COPY_THRESHOLD)
+                    sent = True
+            if not sent:
+                self._drained.set()
+                await self._wakeup.wait()
+                self._wakeup.clear()
+
+    def send(self, channel, frame):
+        """Queue a frame on a channel."""
+        self._start()
+        self._inbox(channel)
+        self.outboxes[channel].append(frame)
+        self._drained.clear()
+        self._wakeup.set()
+
+    async def recv(self, channel):
+        """Return the next frame received on a channel."""
+        self._start()
+        return await self._inbox(channel).get()
+
+    async def accept(self):
+        """Return the next channel opened by the peer."""
+        self._start()
+        return await self.opened.get()
+
+    async def close(self):
+        """Send the queued frames and close the connection."""
+        if self._tasks:
+            await self._drained.wait()
+        for task in self._tasks:
+            task.cancel()
+        self.socket.close(linger=LINGER_MS)
+
+
+class ChannelTransport:
+    """Transport over one channel of a Multiplexer."""
+    passes_objects = False
+
+    def __init__(self, mux, channel):
+        self.mux = mux
+        self.channel = channel
+
+    async def send(self, frame):
+        self.mux.send(self.channel, frame)
+
+    async def recv(self):
+        return await self.mux.recv(self.channel)
+
+    async def poll(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout / 1000
+        inbox = self.mux._inbox(self.channel)
+        while inbox.empty():
+            if loop.time() > deadline:
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+        return True
+
+    def close(self):
+        pass  # the connection is closed by the Multiplexer
+
+
+class ChannelSocket(AsyncSocket):
+    """AsyncSocket over one channel of a Multiplexer.
+
+    Each channel has its own compression codec, logs and round trips, so
+    the protocol runs on it unchanged.
+
+    Args:
+        mux: The Multiplexer.
+        channel: The channel id.
+        logs_file: As for AsyncSocket; 'endpoint' is ignored.
+    """
+    def __init__(self, mux, channel, logs_file, endpoint=None, metrics=None, compress=True, netem=None,
+                 raw_log=None):
+        self.channel_transport = ChannelTransport(mux, channel)
+        super().__init__(None, logs_file, endpoint, bind=False, metrics=metrics, compress=compress,
+                         netem=netem, raw_log=raw_log)
+
+    def _create_transport(self, socket_type, endpoint, bind):
+        return self.channel_transport
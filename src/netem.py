@@ -0,0 +1,103 @@
+import json
+import random
+import time
+
+
+class NetemProfile:
+    """Link characteristics emulated on top of a transport.
+
+    Args:
+        name: Name of the profile (e.g. "wan").
+        rtt_ms: Round-trip time, each direction is delayed by half of it.
+        jitter_ms: Optional; standard deviation of the one-way delay.
+        bandwidth_mbps: Optional; link bandwidth, unlimited if None.
+        reorder_rate: Optional; probability that a frame is held back, as
+            a reordered packet would hold back the in-order stream.
+        reorder_ms: Optional; extra delay of a held back frame.
+        seed: Optional; seed of the random delays, for reproducible runs.
+    """
+    def __init__(self, name, rtt_ms, jitter_ms=0.0, bandwidth_mbps=None,
+                 reorder_rate=0.0, reorder_ms=0.0, seed=None):
+        self.name = name
+        self.rtt_ms = rtt_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_mbps = bandwidth_mbps
+        self.reorder_rate = reorder_rate
+        self.reorder_ms = reorder_ms
+        self.seed = seed
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(**obj)
+
+    def to_json(self):
+        return dict(vars(self))
+
+    def transmit_time(self, size):
+        """Seconds needed to put 'size' bytes on the link."""
+        if not self.bandwidth_mbps:
+            return 0.0
+        return size * 8 / (self.bandwidth_mbps * 1e6)
+
+    def delay(self, size, rng):
+        """Return the one-way delay (seconds) of a frame of 'size' bytes."""
+        delay = self.rtt_ms / 2
+        if self.jitter_ms:
+            delay = max(0.0, rng.gauss(delay, self.jitter_ms))
+        if self.reorder_rate and rng.random() < self.reorder_rate:
+            delay += self.reorder_ms
+        return delay / 1000 + self.transmit_time(size)
+
+
+def load_profiles(file_path):
+    """Return the profiles of a JSON file {"profiles": [{"name": ..., ...}]}."""
+    with open(file_path) as file:
+        return [NetemProfile.from_json(obj) for obj in json.load(file)["profiles"]]
+
+
+def load_profile(file_path, name=None):
+    """Return the profile 'name' of a file, its first profile by default."""
+    profiles = load_profiles(file_path)
+    if name is None:
+        return profiles[0]
+    for profile in profiles:
+        if profile.name == name:
+            return profile
+    raise ValueError(f"Unknown network profile '{name}' in {file_path}")
+
+
+class NetemTransport:
+    """Transport delaying the frames sent through another transport.
+
+    Frames are held back by the sender for the one-way delay of the profile,
+    which is exact for the request-reply exchanges of the protocol (a
+    single frame in flight). Each party delays its own direction, so both
+    must use the profile. With objects passed by reference (inproc://)
+    there is no frame size and bandwidth is not emulated.
+
+    Args:
+        transport: The wrapped transport.
+        profile: A NetemProfile.
+    """
+    def __init__(self, transport, profile):
+        self.transport = transport
+        self.profile = profile
+        self.passes_objects = transport.passes_objects
+        self.rng = random.Random(profile.seed)
+
+    def _delay(self, frame):
+        size = 0 if self.passes_objects else len(frame)
+        return self.profile.delay(size, self.rng)
+
+    def send(self, frame):
+        time.sleep(self._delay(frame))
+        self.transport.send(frame)
+
+    def recv(self):
+        return self.transport.recv()
+
+    def poll(self, timeout):
+        return self.transport.poll(timeout)
+
+    def close(self):
+        self.transport.close()
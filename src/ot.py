@@ -1,6 +1,7 @@
 import hashlib
 import logging
 import pickle
+import random
 from src import util, yao
 
 
@@ -8,38 +9,41 @@ class ObliviousTransfer:
     def __init__(self, socket, enabled=True):
         self.socket = socket
         self.enabled = enabled
-
-    def get_result(self, a_inputs, b_keys):
+        self.metrics = socket.metrics
+        self.received_instance = None  # last fresh instance sent by Alice
+        self.carry = None  # output wire -> input wire of a sequential circuit
+        self.carried = {}  # labels carried to the next evaluation
+        self.pool = None  # EvaluationPool deferring evaluations, see src.pool
+        self.group = None  # group of the OTs, see _session_group
+        # seeded OT randomness when the session is recorded or replayed (see src.replay)
+        self.rng = random.Random(socket.seed) if socket.seed is not None else None
+
+    def get_result(self, a_inputs, b_keys, instance=None):
         """Send Alice's inputs and retrieve Bob's result of evaluation.
 
         Args:
             a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
             b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+            instance: Optional; a dict with the "garbled_tables" and
+                "pbits_out" of a fresh garbled instance to evaluate.
 
         Returns:
             The result of the yao circuit evaluation.
         """
-        logging.debug("Sending inputs to Bob")
-        self.socket.messages.append({
-            'type': f'OT ({self.enabled})',
-            'data': "Sending inputs to Bob"
-        })
-        self.socket.send(a_inputs)
-
-        for _ in range(len(b_keys)):
-            w = self.socket.receive()  # receive gate ID where to perform OT
-            logging.debug(f"Received gate ID {w}")
-            self.socket.messages.append({
-                'type': f'OT ({self.enabled})',
-                'data': f"Received gate ID {w}"
-            })
-
-            if self.enabled:  # perform oblivious transfer
-                pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
-                self.ot_garbler(pair)
-            else:
-                to_send = (b_keys[w][0], b_keys[w][1])
-                self.socket.send(to_send)
+        self._log("Sending inputs to Bob")
+        self.socket.send((a_inputs, instance))
+
+        with self.metrics.timer('ot'):
+            for _ in range(len(b_keys)):
+                w = self.socket.receive()  # receive gate ID where to perform OT
+                self._log(f"Received gate ID {w}")
+
+                if self.enabled:  # perform oblivious transfer
+                    pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
+                    self.ot_garbler(pair)
+                else:
+                    to_send = (b_keys[w][0], b_keys[w][1])
+                    self.socket.send(to_send)
 
         return self.socket.receive()
 
@@ -51,44 +55,35 @@ class ObliviousTransfer:
             g_tables: Garbled tables of yao circuit.
             pbits_out: p-bits of outputs.
             b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            The result of the yao circuit evaluation.
         """
         # map from Alice's wires to (key, encr_bit) inputs
-        a_inputs = self.socket.receive()
+        a_inputs, instance = self.socket.receive()
         # map from Bob's wires to (key, encr_bit) inputs
         b_inputs_encr = {}
 
-        logging.debug("Received Alice's inputs")
-        self.socket.messages.append({
-            'type': f'OT ({self.enabled})',
-            'data': "Received inputs"
-        })
+        # a fresh garbled instance replaces the tables of the circuit
+        g_tables, pbits_out = self._use_instance(instance, g_tables, pbits_out)
 
-        for w, b_input in b_inputs.items():
-            logging.debug(f"Sending gate ID {w}")
-            self.socket.messages.append({
-                'type': f'OT ({self.enabled})',
-                'data': f"Sending gate ID {w}"
-            })
-            self.socket.send(w)
-
-            if self.enabled:
-                b_inputs_encr[w] = pickle.loads(self.ot_evaluator(b_input))
-            else:
-                pair = self.socket.receive()
-                logging.debug(f"Received key pair, key {b_input} selected")
-                self.socket.messages.append({
-                    'type': f'OT ({self.enabled})',
-                    'data': f"Received key pair, key {b_input} selected"
-                })
-                b_inputs_encr[w] = pair[b_input]
-
-        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs_encr)
-
-        logging.debug("Sending circuit evaluation")
-        self.socket.messages.append({
-            'type': f'OT ({self.enabled})',
-            'data': "Sending circuit evaluation"
-        })
+        self._log("Received Alice's inputs")
+
+        with self.metrics.timer('ot'):
+            for w, b_input in b_inputs.items():
+                self._log(f"Sending gate ID {w}")
+                self.socket.send(w)
+
+                if self.enabled:
+                    b_inputs_encr[w] = pickle.loads(self.ot_evaluator(b_input))
+                else:
+                    pair = self.socket.receive()
+                    self._log(f"Received key pair, key {b_input} selected")
+                    b_inputs_encr[w] = pair[b_input]
+
+        result = self._evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs_encr)
+
+        self._log("Sending circuit evaluation")
         self.socket.send(result)
 
         return result
@@ -99,30 +94,17 @@ class ObliviousTransfer:
         Args:
             msgs: A pair (msg1, msg2) to suggest to Bob.
         """
-        logging.debug("OT protocol started")
-        self.socket.messages.append({
-            'type': f'OT ({self.enabled})',
-            'data': "OT protocol started"
-        })
+        self._log("OT protocol started")
 
-        G = util.PrimeGroup()
+        self.metrics.incr('ots')
+        G = self._session_group()
         self.socket.send_wait(G)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
-        c = G.gen_pow(G.rand_int())
+        c = G.gen_pow(G.rand_int(self.rng))
         h0 = self.socket.send_wait(c)
-        h1 = G.mul(c, G.inv(h0))
-        k = G.rand_int()
-        c1 = G.gen_pow(k)
-        e0 = util.xor_bytes(msgs[0], self.ot_hash(G.pow(h0, k), len(msgs[0])))
-        e1 = util.xor_bytes(msgs[1], self.ot_hash(G.pow(h1, k), len(msgs[1])))
-
-        self.socket.send((c1, e0, e1))
-        logging.debug("OT protocol ended")
-        self.socket.messages.append({
-            'type': f'OT ({self.enabled})',
-            'data': "OT protocol ended"
-        })
+        self.socket.send(self._encrypt_pair(G, c, h0, msgs))
+        self._log("OT protocol ended")
 
     def ot_evaluator(self, b):
         """Oblivious transfer, Bob's side.
@@ -133,30 +115,88 @@ class ObliviousTransfer:
         Returns:
             The message selected by Bob.
         """
-        logging.debug("OT protocol started")
-        self.socket.messages.append({
-            'type': f'OT ({self.enabled})',
-            'data': "OT protocol started"
-        })
-        G = self.socket.receive()
+        self._log("OT protocol started")
+        self.metrics.incr('ots')
+        G = self._session_group(self.socket.receive())
         self.socket.send(True)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
         c = self.socket.receive()
-        x = G.rand_int()
-        x_pow = G.gen_pow(x)
-        h = (x_pow, G.mul(c, G.inv(x_pow)))
-        c1, e0, e1 = self.socket.send_wait(h[b])
-        e = (e0, e1)
-        ot_hash = self.ot_hash(G.pow(c1, x), len(e[b]))
-        mb = util.xor_bytes(e[b], ot_hash)
+        x, h_b = self._choose(G, c, b)
+        mb = self._open(G, x, b, self.socket.send_wait(h_b))
+
+        self._log("OT protocol ended")
+        return mb
 
-        logging.debug("OT protocol ended")
+    def _evaluate(self, circuit, g_tables, pbits_out, a_inputs, b_inputs):
+        """Evaluate the circuit, or only carry its output labels to the next
+        evaluation of a sequential circuit (no p-bits of outputs sent).
+        With a pool the evaluation is queued and its result sent later."""
+        # a_inputs may be Alice's own dict (inproc://), it is not mutated
+        a_inputs = {**a_inputs, **self.carried}
+        if self.pool is not None:
+            self.pool.submit(circuit, g_tables, pbits_out, a_inputs, b_inputs)
+            return None
+        if pbits_out is None:
+            labels = yao.evaluate_labels(circuit, g_tables, a_inputs, b_inputs, metrics=self.metrics)
+            self.carried = {self.carry[w]: labels[w] for w in self.carry}
+            return None
+
+        self.carried = {}
+        return yao.evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs, metrics=self.metrics)
+
+    def _log(self, text):
+        logging.debug(text)
         self.socket.messages.append({
             'type': f'OT ({self.enabled})',
-            'data': "OT protocol ended"
+            'data': text
         })
-        return mb
+
+    def _use_instance(self, instance, g_tables, pbits_out):
+        """Return the tables and output p-bits to evaluate, taken from a
+        fresh instance sent by Alice if any."""
+        self.received_instance = instance
+        if instance is not None:
+            return instance["garbled_tables"], instance["pbits_out"]
+        return g_tables, pbits_out
+
+    def _session_group(self, received=None):
+        """Return the group of the OTs, its generator powers precomputed once
+        per session: Alice draws it on her first OT, Bob keeps the last group
+        received while Alice sends the same one."""
+        group = self.group
+        if received is not None and (group is None or (received.prime, received.generator)
+                                     != (group.prime, group.generator)):
+            group = received
+            group.precompute()
+        elif group is None:
+            group = util.PrimeGroup()
+            group.precompute()
+        self.group = group
+        return group
+
+    def _encrypt_pair(self, G, c, h0, msgs):
+        """Encrypt Alice's pair of messages for Bob's public key h0."""
+        h1 = G.mul(c, G.inv(h0))
+        k = G.rand_int(self.rng)
+        c1 = G.gen_pow(k)
+        e0 = util.xor_bytes(msgs[0], self.ot_hash(G.pow(h0, k), len(msgs[0])))
+        e1 = util.xor_bytes(msgs[1], self.ot_hash(G.pow(h1, k), len(msgs[1])))
+        return c1, e0, e1
+
+    def _choose(self, G, c, b):
+        """Return Bob's secret and the public key selecting message b."""
+        x = G.rand_int(self.rng)
+        x_pow = G.gen_pow(x)
+        h = (x_pow, G.mul(c, G.inv(x_pow)))
+        return x, h[b]
+
+    def _open(self, G, x, b, encrypted):
+        """Decrypt the message selected by Bob."""
+        c1, e0, e1 = encrypted
+        e = (e0, e1)
+        ot_hash = self.ot_hash(G.pow(c1, x), len(e[b]))
+        return util.xor_bytes(e[b], ot_hash)
 
     @staticmethod
     def ot_hash(pub_key, msg_length):
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from src import yao
+from src.transport import SHM_DIR
+
+WORKER_CACHE = 4  # instances kept unpickled by each worker
+
+_instances = {}  # path -> (circuit, garbled_tables, pbits_out), in a worker
+
+
+def _load(path):
+    instance = _instances.get(path)
+    if instance is None:
+        if len(_instances) >= WORKER_CACHE:
+            _instances.pop(next(iter(_instances)))
+        with open(path, "rb") as file:
+            instance = _instances[path] = pickle.load(file)
+    return instance
+
+
+def _evaluate(path, a_inputs, b_inputs):
+    circuit, g_tables, pbits_out = _load(path)
+    return yao.evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs)
+
+
+class EvaluationPool:
+    """Evaluates garbled instances in worker processes.
+
+    The garbled tables of an instance are written once to a file in shared
+    memory, each worker loads them on its first evaluation of the instance:
+    a task only carries the inputs. Results are returned in submission order.
+
+    Args:
+        workers: Optional; number of worker processes (one per CPU by default).
+    """
+    def __init__(self, workers=None):
+        # workers are spawned, a forked zmq context is not safe to use
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = []  # futures of the submitted evaluations, in order
+        self.paths = []  # shared table buffers of the submitted evaluations
+        self._shared = None  # garbled tables of the last buffer written
+        self._count = 0  # buffers written, names are never reused
+
+    def _share(self, circuit, g_tables, pbits_out):
+        if self._shared is not g_tables:
+            path = os.path.join(SHM_DIR, f"yao_tables_{os.getpid()}_{id(self)}_{self._count}")
+            self._count += 1
+            with open(path, "wb") as file:
+                pickle.dump((circuit, g_tables, pbits_out), file, pickle.HIGHEST_PROTOCOL)
+            self.paths.append(path)
+            self._shared = g_tables
+        return self.paths[-1]
+
+    def submit(self, circuit, g_tables, pbits_out, a_inputs, b_inputs):
+        """Queue the evaluation of a garbled instance with given inputs."""
+        path = self._share(circuit, g_tables, pbits_out)
+        # inputs are pickled later by a feeder thread, and the caller may
+        # reuse its dicts meanwhile (e.g. Alice's over inproc://)
+        self.pending.append(self.executor.submit(_evaluate, path, dict(a_inputs), dict(b_inputs)))
+
+    def results(self):
+        """Wait for the queued evaluations and return their results in order."""
+        results = [future.result() for future in self.pending]
+        self.pending = []
+        self._release()
+        return results
+
+    def _release(self):
+        for path in self.paths:
+            os.unlink(path)
+        self.paths = []
+        self._shared = None
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self._release()
@@ -0,0 +1,181 @@
+import logging
+import mmap
+import os
+import pickle
+import struct
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from src import util, yao
+from src.metrics import NULL_METRICS
+
+STORE_MAGIC = b"YAOS"
+STORE_VERSION = 1
+# magic, version, number of circuits, instances per circuit, offset of index
+STORE_HEADER = struct.Struct("<4sHIIQ")
+NONCE_SIZE = 12
+
+
+def load_key(key_path, create=False):
+    """Return the local key sealing the label seeds of a store.
+
+    Args:
+        key_path: Path of the key file.
+        create: Optional; create a new key if the file does not exist.
+    """
+    if create and not os.path.exists(key_path):
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(AESGCM.generate_key(bit_length=128))
+
+    with open(key_path, "rb") as file:
+        return file.read()
+
+
+def _aad(circuit_index, instance_index):
+    return struct.pack("<II", circuit_index, instance_index)
+
+
+def garble_store(circuits_path, store_path, count, key_path=None,
+                 metrics=NULL_METRICS):
+    """Garble 'count' instances of every circuit of a file ahead of time.
+
+    The store holds the circuits spec, then one record per instance with its
+    garbled tables, output p-bits and label seed. Seeds are sealed with a
+    local key (AES-GCM) so the store itself does not reveal any label.
+
+    Args:
+        circuits_path: The JSON file containing circuits.
+        store_path: Path of the store to write.
+        count: Number of instances per circuit.
+        key_path: Optional; path of the sealing key (store_path + ".key").
+        metrics: Optional; a Metrics instance collecting the "garble" phase.
+    """
+    circuits = util.parse_json(circuits_path)
+    aead = AESGCM(load_key(key_path or store_path + ".key", create=True))
+    index = []  # (offset, length) of each record
+
+    with open(store_path, "wb") as file:
+        file.write(bytes(STORE_HEADER.size))  # written last
+
+        def write_record(record):
+            data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            index.append((file.tell(), len(data)))
+            file.write(data)
+
+        write_record({"name": circuits["name"], "circuits": circuits["circuits"]})
+
+        for i, circuit in enumerate(circuits["circuits"]):
+            for j in range(count):
+                garbled_circuit = yao.GarbledCircuit(circuit, metrics=metrics)
+                nonce = os.urandom(NONCE_SIZE)
+                write_record({
+                    "garbled_tables": garbled_circuit.get_garbled_tables(),
+                    "pbits_out": {w: garbled_circuit.pbits[w] for w in circuit["out"]},
+                    "sealed_seed": nonce + aead.encrypt(nonce, garbled_circuit.seed, _aad(i, j)),
+                })
+                logging.debug(f"Garbled instance {j} of {circuit['id']}")
+
+        index_offset = file.tell()
+        for offset, length in index:
+            file.write(struct.pack("<QQ", offset, length))
+
+        file.seek(0)
+        file.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(circuits["circuits"]),
+                                     count, index_offset))
+
+
+class GarbledStore:
+    """A memory-mapped store of pre-garbled circuit instances.
+
+    Args:
+        store_path: Path of a store written by garble_store.
+        key_path: Optional; path of the sealing key (store_path + ".key").
+    """
+    def __init__(self, store_path, key_path=None):
+        self.aead = AESGCM(load_key(key_path or store_path + ".key"))
+
+        with open(store_path, "rb") as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_circuits, count, index_offset = STORE_HEADER.unpack_from(self.mapping, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"Not a garbled circuit store: {store_path}")
+
+        self.count = count  # instances per circuit
+        self.index = memoryview(self.mapping)[index_offset:].cast("Q")
+
+        spec = self._record(0)
+        self.name = spec["name"]
+        self.circuits = spec["circuits"]
+
+    def _record(self, i):
+        offset, length = self.index[2 * i], self.index[2 * i + 1]
+        with memoryview(self.mapping)[offset:offset + length] as data:
+            return pickle.loads(data)
+
+    def instance(self, circuit_index, instance_index):
+        """Return an instance as a circuit entry with its keys and p-bits.
+
+        Args:
+            circuit_index: Position of the circuit in the circuits file.
+            instance_index: Position of the instance, in [0, count).
+        """
+        circuit = self.circuits[circuit_index]
+        record = self._record(1 + circuit_index * self.count + instance_index)
+        sealed = record["sealed_seed"]
+        seed = self.aead.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:],
+                                 _aad(circuit_index, instance_index))
+        keys, pbits = yao.derive_labels(circuit, seed)
+
+        return {
+            "circuit": circuit,
+            "garbled_tables": record["garbled_tables"],
+            "keys": keys,
+            "pbits": pbits,
+            "pbits_out": record["pbits_out"],
+            "seed": seed,
+            "id": (circuit_index, instance_index),
+        }
+
+    def instances(self, circuit_index, start=0):
+        """Iterate over the instances of a circuit, from the 'start'-th one.
+
+        Once the store is exhausted the last instance is reused, as the
+        online garbler does with its single garbled circuit.
+        """
+        instance = None
+        for j in range(start, self.count):
+            instance = self.instance(circuit_index, j)
+            yield instance
+
+        if instance is None:
+            instance = self.instance(circuit_index, self.count - 1)
+
+        logging.warning(f"Store exhausted for circuit {self.circuits[circuit_index]['id']}, "
+                        f"reusing its last instance")
+        while True:
+            yield instance
+
+    def close(self):
+        self.index.release()
+        self.mapping.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="Yao Protocol - offline garbling",
+                                     description="Garble circuit instances ahead of time into a store")
+    parser.add_argument("circuit", help="Path to circuit file")
+    parser.add_argument("store", help="Path for the store")
+    parser.add_argument("-k", "--count", help="Number of instances per circuit", default=100)
+    parser.add_argument("--key", help="Path of the sealing key (default: <store>.key)", default=None)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.circuit):
+        raise FileNotFoundError(f"Circuit file not found: {args.circuit}")
+
+    if int(args.count) < 1:
+        raise ValueError("Count must be a positive int")
+
+    garble_store(args.circuit, args.store, int(args.count), args.key)
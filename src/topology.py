@@ -0,0 +1,59 @@
+import json
+import os
+from src import yao
+
+
+class TopologyCache:
+    """Circuit specs known to Bob, by hash (see yao.circuit_hash).
+
+    Alice sends the hash of a circuit instead of its spec, and the spec
+    only when Bob does not have it. A circuit found here is the same
+    object on every use, so its evaluator is compiled once (see
+    yao.compile_circuit). With a directory, specs are also kept on disk
+    for the next sessions, one JSON file per hash written atomically.
+
+    Args:
+        directory: Optional; directory of the cache, kept in memory only
+            if None.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.circuits = {}  # hash -> circuit spec
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest):
+        """Return the circuit of a hash, None if it is not cached."""
+        circuit = self.circuits.get(digest)
+        if circuit is None and self.directory is not None:
+            try:
+                with open(self._path(digest)) as file:
+                    circuit = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+            if yao.circuit_hash(circuit) != digest:  # stale or corrupted file
+                return None
+            self.circuits[digest] = circuit
+        return circuit
+
+    def add(self, circuit, digest=None):
+        """Cache a circuit and return it.
+
+        Args:
+            circuit: A dict containing circuit spec.
+            digest: Optional; the hash the circuit was asked for, checked.
+        """
+        actual = yao.circuit_hash(circuit)
+        if digest is not None and actual != digest:
+            raise ValueError(f"Circuit {circuit.get('id')} does not match hash {digest}")
+
+        self.circuits[actual] = circuit
+        if self.directory is not None:
+            tmp_path = f"{self._path(actual)}.{os.getpid()}"
+            with open(tmp_path, "w") as file:
+                json.dump(circuit, file)
+            os.replace(tmp_path, self._path(actual))
+        return circuit
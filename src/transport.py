@@ -0,0 +1,290 @@
+import mmap
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zmq
+from src import replay
+
+ZERO_COPY_THRESHOLD = 64 * 1024  # zmq only benefits from copy=False on large frames
+SHM_CAPACITY = 4 * 1024 * 1024  # bytes per direction of a shared memory ring
+CONNECT_TIMEOUT = 10  # seconds to wait for the binding party
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+class ZmqTransport:
+    """Transport over a zmq socket (tcp://, ipc://, ...).
+
+    Args:
+        socket_type: The zmq socket type (e.g. zmq.REQ).
+        endpoint: The zmq endpoint.
+        bind: Bind to the endpoint if True, connect otherwise.
+    """
+    passes_objects = False  # frames are pickled bytes
+
+    def __init__(self, socket_type, endpoint, bind):
+        self.endpoint = endpoint
+        self.socket = zmq.Context().socket(socket_type)
+
+        if bind:
+            self.socket.bind(endpoint)
+        else:
+            self.socket.connect(endpoint)
+
+    def send(self, frame):
+        self.socket.send(frame, copy=len(frame) < ZERO_COPY_THRESHOLD)
+
+    def recv(self):
+        return self.socket.recv()
+
+    def poll(self, timeout):
+        """Return True if a frame is available within 'timeout' ms."""
+        return bool(self.socket.poll(timeout, zmq.POLLIN))
+
+    def close(self):
+        self.socket.close()
+
+
+class InprocTransport:
+    """Transport between two threads of the same process (inproc://name).
+
+    Messages are handed over by reference: there is no serialization and
+    no copy. A sent message must not be mutated until the peer has answered.
+    """
+    passes_objects = True  # frames are the messages themselves
+
+    _channels = {}  # name -> pair of queues (to binder, to connector)
+    _lock = threading.Lock()
+
+    def __init__(self, endpoint, bind):
+        self.endpoint = endpoint
+        name = endpoint[len("inproc://"):]
+
+        with self._lock:
+            if name not in self._channels:
+                self._channels[name] = (queue.SimpleQueue(), queue.SimpleQueue())
+            to_binder, to_connector = self._channels[name]
+
+        self._name = name
+        self._bind = bind
+        self._in, self._out = (to_binder, to_connector) if bind else (to_connector, to_binder)
+        self._pending = []  # frame taken from the queue by poll()
+
+    def send(self, frame):
+        self._out.put(frame)
+
+    def recv(self):
+        if self._pending:
+            return self._pending.pop()
+        return self._in.get()
+
+    def poll(self, timeout):
+        if self._pending:
+            return True
+        try:
+            self._pending.append(self._in.get(timeout=timeout / 1000))
+            return True
+        except queue.Empty:
+            return False
+
+    def close(self):
+        if self._bind:
+            with self._lock:
+                self._channels.pop(self._name, None)
+
+
+class _Ring:
+    """Single-producer single-consumer byte ring in shared memory.
+
+    The first 16 bytes hold the total number of bytes written (head) and
+    read (tail), followed by 'capacity' bytes of data.
+    """
+    HEADER = struct.Struct("<QQ")
+
+    def __init__(self, buf, capacity):
+        self.buf = buf
+        self.capacity = capacity
+        self.data = buf[self.HEADER.size:self.HEADER.size + capacity]
+
+    def _indices(self):
+        return self.HEADER.unpack_from(self.buf, 0)
+
+    def available(self):
+        head, tail = self._indices()
+        return head - tail
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        offset, size = 0, len(view)
+        backoff = _Backoff()
+
+        while offset < size:
+            head, tail = self._indices()
+            free = self.capacity - (head - tail)
+            if not free:
+                backoff.wait()
+                continue
+
+            chunk = min(free, size - offset)
+            pos = head % self.capacity
+            first = min(chunk, self.capacity - pos)
+            self.data[pos:pos + first] = view[offset:offset + first]
+            if chunk > first:
+                self.data[:chunk - first] = view[offset + first:offset + chunk]
+
+            struct.pack_into("<Q", self.buf, 0, head + chunk)  # publish
+            offset += chunk
+            backoff.reset()
+
+    def read(self, size):
+        out = bytearray(size)
+        offset = 0
+        backoff = _Backoff()
+
+        while offset < size:
+            head, tail = self._indices()
+            if head == tail:
+                backoff.wait()
+                continue
+
+            chunk = min(head - tail, size - offset)
+            pos = tail % self.capacity
+            first = min(chunk, self.capacity - pos)
+            out[offset:offset + first] = self.data[pos:pos + first]
+            if chunk > first:
+                out[offset + first:offset + chunk] = self.data[:chunk - first]
+
+            struct.pack_into("<Q", self.buf, 8, tail + chunk)  # release
+            offset += chunk
+            backoff.reset()
+
+        return out
+
+
+class _Backoff:
+    """Spin, then yield, then sleep with an increasing delay."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rounds = 0
+
+    def wait(self):
+        self.rounds += 1
+        if self.rounds > 100:
+            # the exponent is capped: 2 ** 10 us already exceeds the 1 ms ceiling
+            time.sleep(min(1e-3, 1e-6 * 2**min((self.rounds - 100) // 10, 10)))
+        else:
+            time.sleep(0)
+
+
+def _alive(pid):
+    if pid <= 0:  # not written by a binding party (0 is our process group)
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # alive, owned by another user
+        pass
+    return True
+
+
+class ShmTransport:
+    """Transport between processes of the same host (shm://name).
+
+    The binding party creates a memory-mapped file in shared memory holding
+    one ring buffer per direction; frames are length-prefixed pickled bytes.
+    The file starts with the pid of the binding party: a file left behind by
+    a killed party is ignored by the connecting one, which waits for a live
+    binder to replace it.
+    """
+    passes_objects = False
+    LENGTH = struct.Struct("<Q")
+    BINDER = struct.Struct("<Q")  # pid of the binding party
+
+    def __init__(self, endpoint, bind, capacity=SHM_CAPACITY):
+        self.endpoint = endpoint
+        self.path = os.path.join(SHM_DIR, "yao_" + endpoint[len("shm://"):])
+        self._bind = bind
+
+        if bind:
+            size = self.BINDER.size + 2 * (_Ring.HEADER.size + capacity)
+            tmp_path = f"{self.path}.{os.getpid()}"
+            with open(tmp_path, "wb") as file:
+                file.write(self.BINDER.pack(os.getpid()))
+                file.truncate(size)
+            os.replace(tmp_path, self.path)  # the peer never sees a partial file
+            with open(self.path, "r+b") as file:
+                self.mmap = mmap.mmap(file.fileno(), 0)
+        else:
+            self.mmap = self._open(self.path)
+
+        half = (len(self.mmap) - self.BINDER.size) // 2
+        capacity = half - _Ring.HEADER.size
+        view = memoryview(self.mmap)[self.BINDER.size:]
+        to_binder = _Ring(view[:half], capacity)
+        to_connector = _Ring(view[half:2 * half], capacity)
+        self._in, self._out = (to_binder, to_connector) if bind else (to_connector, to_binder)
+
+    @classmethod
+    def _open(cls, path):
+        """Map the file of a live binding party, waiting for it."""
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                with open(path, "r+b") as file:
+                    mapping = mmap.mmap(file.fileno(), 0)
+                pid, = cls.BINDER.unpack_from(mapping, 0)
+                if _alive(pid):
+                    return mapping
+                mapping.close()  # left behind by a killed party
+            except FileNotFoundError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No party bound to {path}")
+            time.sleep(0.01)
+
+    def send(self, frame):
+        self._out.write(self.LENGTH.pack(len(frame)))
+        self._out.write(frame)
+
+    def recv(self):
+        size, = self.LENGTH.unpack(self._in.read(self.LENGTH.size))
+        return self._in.read(size)
+
+    def poll(self, timeout):
+        deadline = time.monotonic() + timeout / 1000
+        backoff = _Backoff()
+        while not self._in.available():
+            if time.monotonic() > deadline:
+                return False
+            backoff.wait()
+        return True
+
+    def close(self):
+        # release the views before closing the mapping
+        self._in = self._out = None
+        self.mmap.close()
+        if self._bind:
+            os.unlink(self.path)
+
+
+def create(socket_type, endpoint, bind):
+    """Create the transport matching the scheme of 'endpoint'.
+
+    Args:
+        socket_type: The zmq socket type used for zmq endpoints.
+        endpoint: "inproc://name", "shm://name", "replay://path" or any zmq
+            endpoint.
+        bind: True for the party waiting for connections (Bob).
+    """
+    if endpoint.startswith(replay.SCHEME):
+        return replay.ReplayTransport(endpoint)
+    if endpoint.startswith("inproc://"):
+        return InprocTransport(endpoint, bind)
+    if endpoint.startswith("shm://"):
+        return ShmTransport(endpoint, bind)
+    return ZmqTransport(socket_type, endpoint, bind)
@@ -1,14 +1,17 @@
 import json
 import operator
+import pickle
 import random
 import secrets
-import sympy
 import zmq
+from src import compression, netem as netem_, replay, transport
+from src.metrics import NULL_METRICS
 
 # SOCKET
 LOCAL_PORT = 4080
 SERVER_HOST = "localhost"
 SERVER_PORT = 4080
+DEFAULT_ENDPOINT = f"tcp://{SERVER_HOST}:{SERVER_PORT}"
 
 
 # ADDED
@@ -34,43 +37,131 @@ def transform_data(obj):
 
 # UPDATED
 class Socket:
-    def __init__(self, socket_type, logs_file):
-        self.socket = zmq.Context().socket(socket_type)
-        self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
+    def __init__(self, socket_type, logs_file, endpoint, bind, metrics=None, compress=True, netem=None,
+                 raw_log=None):
+        self.transport = self._create_transport(socket_type, endpoint, bind)
+        # seed of the OT randomness: the recorded one when replaying a raw
+        # log, a fresh one when recording a raw log (see src.replay)
+        self.seed = getattr(self.transport, "seed", None)
+        if self.seed is None and raw_log is not None:
+            self.seed = secrets.randbits(64)
+        if netem is not None:  # emulated link, see src.netem
+            self.transport = self._emulate(self.transport, netem)
+        self.compress = compress and not self.transport.passes_objects
+        self.codec = None  # compression codec agreed with the other party
 
         self.logs_file = logs_file
         self.messages = []
+        self.raw_log = raw_log
+        self.recording = replay.Recording(self.seed) if raw_log is not None else None
+        self.metrics = metrics or NULL_METRICS
+        self._awaiting_reply = False  # a send is not yet answered
+
+    # ADDED
+    @staticmethod
+    def _create_transport(socket_type, endpoint, bind):
+        return transport.create(socket_type, endpoint, bind)
+
+    # ADDED
+    @staticmethod
+    def _emulate(transport, profile):
+        return netem_.NetemTransport(transport, profile)
 
     # UPDATED
     def send(self, msg):
+        self.transport.send(self._encode(msg))
+
+    # UPDATED
+    def receive(self):
+        with self.metrics.timer('network'):
+            frame = self.transport.recv()
+        return self._decode(frame)
+
+    # ADDED
+    def _encode(self, msg):
         self.messages.append({
             'type': 'communication',
             'direction': 'send',
             'data': transform_data(msg)
         })
-        self.socket.send_pyobj(msg)
+        if self.recording is not None:
+            self.recording.add('send', msg)
+        self.metrics.incr('messages_sent')
+        self._awaiting_reply = True
 
-    # UPDATED
-    def receive(self):
-        rcv = self.socket.recv_pyobj()
+        if self.transport.passes_objects:
+            return msg
+
+        with self.metrics.timer('serialize'):
+            payload = pickle.dumps(msg, pickle.DEFAULT_PROTOCOL)
+            frame = compression.encode(self.codec, payload, self.metrics)
+        self.metrics.incr('bytes_uncompressed_sent', len(payload))
+        self.metrics.incr('bytes_sent', len(frame))
+        return frame
 
+    # ADDED
+    def _decode(self, frame):
+        rcv = self._deserialize(frame)
         self.messages.append({
             'type': 'communication',
             'direction': 'receive',
             'data': transform_data(rcv)
         })
+        if self.recording is not None:
+            self.recording.add('receive', rcv)
         return rcv
 
+    def _deserialize(self, frame):
+        if self._awaiting_reply:
+            self.metrics.incr('round_trips')
+            self._awaiting_reply = False
+        self.metrics.incr('messages_received')
+        if self.transport.passes_objects:
+            return frame
+
+        self.metrics.incr('bytes_received', len(frame))
+        with self.metrics.timer('serialize'):
+            return pickle.loads(compression.decode(frame))
+
     def send_wait(self, msg):
         self.send(msg)
         return self.receive()
 
+    # ADDED
+    def negotiate(self):
+        """Offer the available compression codecs to the other party and
+        use the one it picks (garbler side, at session start)."""
+        self.codec = compression.by_name(self.send_wait(self._hello()))
+
+    # ADDED
+    def answer(self, hello):
+        """Pick a compression codec among the ones offered in a 'hello'
+        message (evaluator side)."""
+        name = self._choose_codec(hello)
+        self.send(name)
+        self.codec = compression.by_name(name)
+
+    def _hello(self):
+        offer = [codec.name for codec in compression.codecs()] if self.compress else []
+        return {
+            'type': 'hello',
+            'compression': offer
+        }
+
+    def _choose_codec(self, hello):
+        return compression.choose(hello['compression']) if self.compress else None
+
+    # ADDED
+    def close(self):
+        self.transport.close()
+
     # ADDED
     def create_logs_file(self):
         with open(self.logs_file, 'w') as file:
             data = json.dumps(transform_data(self.messages), indent=4)
             file.write(data)
+        if self.recording is not None:
+            self.recording.save(self.raw_log)
 
     """
     From https://stackoverflow.com/questions/17174001/stop-pyzmq-receiver-by-keyboardinterrupt
@@ -80,38 +171,77 @@ class Socket:
     def poll_socket(self, timetick=100):
         try:
             while True:
-                obj = dict(self.poller.poll(timetick))
-                if self.socket in obj and obj[self.socket] == zmq.POLLIN:
-                    rcv = self.socket.recv_pyobj()
-                    self.messages.append({
-                        'type': 'communication',
-                        'direction': 'receive',
-                        'data': transform_data(rcv)
-                    })
-                    yield rcv
+                if self.transport.poll(timetick):
+                    yield self._decode(self.transport.recv())
         except KeyboardInterrupt:
             pass
 
 
 class EvaluatorSocket(Socket):
-    def __init__(self, logs_file, endpoint=f"tcp://*:{LOCAL_PORT}"):
-        super().__init__(zmq.REP, logs_file)
-        self.socket.bind(endpoint)
+    def __init__(self, logs_file, endpoint=f"tcp://*:{LOCAL_PORT}", metrics=None, compress=True, netem=None,
+                 raw_log=None):
+        super().__init__(zmq.REP, logs_file, endpoint, bind=True, metrics=metrics, compress=compress,
+                         netem=netem, raw_log=raw_log)
 
 
 class GarblerSocket(Socket):
-    def __init__(self, logs_file, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
-        super().__init__(zmq.REQ, logs_file)
-        self.socket.connect(endpoint)
+    def __init__(self, logs_file, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}", metrics=None, compress=True, netem=None,
+                 raw_log=None):
+        super().__init__(zmq.REQ, logs_file, endpoint, bind=False, metrics=metrics, compress=compress,
+                         netem=netem, raw_log=raw_log)
 
 
 # PRIME GROUP
 PRIME_BITS = 64  # order of magnitude of prime in base 2
+# default group modulus, a PRIME_BITS safe prime p = 2q + 1 (q prime)
+SAFE_PRIME = 0xc000000000000683
+FIXED_BASE_WINDOW = 8  # bits of the exponent per precomputed generator table
+
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+MR_DETERMINISTIC_BOUND = 3317044064679887385961981  # SMALL_PRIMES bases suffice below
+
+
+# UPDATED
+def is_prime(num, rounds=16):
+    """Miller-Rabin primality test, deterministic below 3.3e24 and with
+    'rounds' extra random bases above."""
+    if num < 2:
+        return False
+    for p in SMALL_PRIMES:
+        if num % p == 0:
+            return num == p
+
+    d, s = num - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    bases = SMALL_PRIMES
+    if num >= MR_DETERMINISTIC_BOUND:
+        bases += tuple(secrets.randbelow(num - 3) + 2 for _ in range(rounds))
+
+    for a in bases:
+        x = pow(a, d, num)
+        if x == 1 or x == num - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % num
+            if x == num - 1:
+                break
+        else:
+            return False
+    return True
 
 
+# UPDATED
 def next_prime(num):
     """Return next prime after 'num' (skip 2)."""
-    return 3 if num < 3 else sympy.nextprime(num)
+    if num < 3:
+        return 3
+    candidate = num + 1 + num % 2  # next odd number
+    while not is_prime(candidate):
+        candidate += 2
+    return candidate
 
 
 def gen_prime(num_bits):
@@ -120,6 +250,16 @@ def gen_prime(num_bits):
     return next_prime(r)
 
 
+# ADDED
+def gen_safe_prime(num_bits=PRIME_BITS):
+    """Return a random safe prime p = 2q + 1 of bit size 'num_bits'."""
+    while True:
+        q = next_prime(secrets.randbits(num_bits - 1) | 1 << (num_bits - 2))
+        p = 2 * q + 1
+        if p.bit_length() == num_bits and is_prime(p):
+            return p
+
+
 def xor_bytes(seq1, seq2):
     """XOR two byte sequence."""
     return bytes(map(operator.xor, seq1, seq2))
@@ -131,12 +271,21 @@ def bits(num, width):
 
 
 class PrimeGroup:
-    """Cyclic abelian group of prime order 'prime'."""
+    """Cyclic abelian group of prime order 'prime'.
+
+    Args:
+        prime: Optional; a safe prime (see gen_safe_prime), SAFE_PRIME by
+            default.
+    """
+
+    _gen_table = None  # (window, rows) of generator powers, see precompute
 
     def __init__(self, prime=None):
-        self.prime = prime or gen_prime(num_bits=PRIME_BITS)
+        self.prime = prime or SAFE_PRIME
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
+        if prime is not None and not (is_prime(prime) and is_prime(self.prime_m1 // 2)):
+            raise ValueError(f"Group modulus must be a safe prime: {prime}")
         self.generator = self.find_generator()
 
     def mul(self, num1, num2):
@@ -149,19 +298,53 @@ class PrimeGroup:
 
     def gen_pow(self, exponent):  # generator exponentiation
         "Compute nth power of a generator." ""
-        return pow(self.generator, exponent, self.prime)
+        if self._gen_table is None:
+            return pow(self.generator, exponent, self.prime)
+
+        window, rows = self._gen_table
+        if exponent >> (window * len(rows)):  # beyond the table
+            return pow(self.generator, exponent, self.prime)
+        mask = (1 << window) - 1
+        result = 1
+        for row in rows:  # one multiplication per window of the exponent
+            result = result * row[exponent & mask] % self.prime
+            exponent >>= window
+        return result
 
     def inv(self, num):
         "Multiplicative inverse of an element." ""
-        return pow(num, self.prime_m2, self.prime)
-
-    def rand_int(self):  # random int in [1, prime-1]
-        "Return an random int in [1, prime - 1]." ""
-        return random.randint(1, self.prime_m1)
+        return pow(num, -1, self.prime)
+
+    def precompute(self, window=FIXED_BASE_WINDOW):
+        """Precompute the generator powers used by gen_pow.
+
+        Row i holds g^(d * 2^(window * i)) for each digit d < 2^window, so
+        a generator power costs one multiplication per window instead of a
+        square-and-multiply. Worth it for a group used by many OTs.
+        """
+        rows = []
+        base = self.generator
+        for _ in range(-(-self.prime.bit_length() // window)):
+            row = [1]
+            for _ in range((1 << window) - 1):
+                row.append(row[-1] * base % self.prime)
+            rows.append(row)
+            base = row[-1] * base % self.prime
+        self._gen_table = (window, rows)
+
+    def __getstate__(self):
+        # the table is rebuilt by the receiver, not sent
+        state = dict(self.__dict__)
+        state.pop("_gen_table", None)
+        return state
+
+    def rand_int(self, rng=None):  # random int in [1, prime-1]
+        "Return an random int in [1, prime - 1], drawn from 'rng' if given." ""
+        return (rng or random).randint(1, self.prime_m1)
 
     def find_generator(self):  # find random generator for group
         """Find a random generator for the group."""
-        factors = sympy.primefactors(self.prime_m1)
+        factors = (2, self.prime_m1 // 2)  # prime factors of p - 1 for a safe prime
 
         while True:
             candidate = self.rand_int()
@@ -1,8 +1,11 @@
+import hashlib
+import json
 import os
 import pickle
-import random
+from collections.abc import Mapping
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from src.metrics import NULL_METRICS
 
 
 # UPDATED
@@ -50,7 +53,7 @@ def generate_key():
     return os.urandom(16)
 
 
-def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
+def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs, metrics=NULL_METRICS):
     """Evaluate yao circuit with given inputs.
 
     Args:
@@ -59,79 +62,423 @@ def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
         pbits_out: The pbits of outputs.
         a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
         b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        metrics: Optional; a Metrics instance collecting the "evaluate" phase.
 
     Returns:
         A dict mapping output wires with their result bit.
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
-
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
-
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
-        # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
-            # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in, )]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
-        # Else the gate has two input wires (same model)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
-            msg = decrypt(key_b, decrypt(key_a, encr_msg))
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
-
-    # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ pbits_out[out]
+    evaluator = compile_circuit(circuit)
+
+    with metrics.timer('evaluate'):
+        evaluation = evaluator(g_tables, pbits_out, a_inputs, b_inputs)
+
+    if metrics.enabled:
+        metrics.incr('gates_evaluated', evaluator.gates)
+        metrics.incr('aes_invocations', evaluator.aes_invocations)
 
     return evaluation
 
 
+# ADDED
+def evaluate_labels(circuit, g_tables, a_inputs, b_inputs, metrics=NULL_METRICS):
+    """Evaluate yao circuit without decoding its outputs.
+
+    Returns:
+        A dict mapping output wires with their (key, encr_bit) label, to be
+        carried to the next evaluation of a sequential circuit.
+    """
+    evaluator = compile_circuit(circuit, decode=False)
+
+    with metrics.timer('evaluate'):
+        labels = evaluator(g_tables, None, a_inputs, b_inputs)
+
+    if metrics.enabled:
+        metrics.incr('gates_evaluated', evaluator.gates)
+        metrics.incr('aes_invocations', evaluator.aes_invocations)
+
+    return labels
+
+
+# ADDED
+def carry_wires(circuit):
+    """Return the mapping from the output wires of a sequential circuit to
+    Alice's input wires they feed in the next evaluation.
+
+    The mapping is the "carry" list of [output, input] pairs of the spec.
+    By default outputs feed Alice's wires in reverse order: outputs are
+    least significant bit first (see utils.parse_circuit_output), Alice's
+    wires most significant bit first (see utils.InputArray.bits).
+    """
+    a_wires = circuit.get("alice", [])
+    if "carry" in circuit:
+        carry = {out: inp for out, inp in circuit["carry"]}
+    else:
+        if len(circuit["out"]) != len(a_wires):
+            raise ValueError(f"Circuit {circuit.get('id')} needs a 'carry' list to be sequential")
+        carry = dict(zip(circuit["out"], reversed(a_wires)))
+
+    if not set(carry.values()) <= set(a_wires):
+        raise ValueError(f"Carried wires of {circuit.get('id')} must be Alice's input wires")
+    return carry
+
+
+# ADDED
+_compiled = {}  # (circuit hash, decode) -> evaluator
+_last = (None, None, None)  # last circuit compiled or looked up, decode, evaluator
+
+
+def circuit_hash(circuit):
+    """Return a hash identifying the spec of a circuit."""
+    data = json.dumps(circuit, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def compile_circuit(circuit, decode=True):
+    """Return the evaluator of a circuit, generated on first use.
+
+    The evaluator is a straight-line Python function: gates are evaluated in
+    order of id, a gate being skipped if one of its inputs is not computed.
+    Labels are held in local variables reused once their wire is dead (see
+    allocate_slots), so an evaluation keeps a number of labels bounded by
+    the width of the circuit, not its size. Evaluators are cached by
+    circuit hash.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        decode: Optional; return output bits (True by default) rather than
+            output labels.
+    """
+    global _last
+    if _last[0] is circuit and _last[1] == decode:  # same as the previous evaluation
+        return _last[2]
+
+    key = (circuit_hash(circuit), decode)
+    evaluator = _compiled.get(key)
+    if evaluator is None:
+        evaluator = _compiled[key] = _generate(circuit, *key)
+
+    _last = (circuit, decode, evaluator)
+    return evaluator
+
+
+def allocate_slots(gates, outputs, inputs=()):
+    """Assign the wires of a circuit to slots of a fixed-size label buffer.
+
+    Like register allocation: a wire takes a free slot when first written
+    or read and gives it back after the last gate touching it, so the
+    number of slots follows the width of the circuit. Output wires keep
+    their slot to the end.
+
+    Args:
+        gates: The gates in the order they are processed.
+        outputs: The wires read after the last gate.
+        inputs: Optional; wires written before the first gate.
+
+    Returns:
+        A pair (dict mapping each wire to its slot, number of slots).
+    """
+    last = {}  # wire -> index of the last gate touching it
+    for i, gate in enumerate(gates):
+        for w in gate["in"]:
+            last[w] = i
+        last[gate["id"]] = i
+    for w in outputs:
+        last[w] = len(gates)
+
+    slots, free = {}, []
+    count = 0
+
+    def allocate(wire):
+        nonlocal count
+        if wire not in slots:
+            if free:
+                slots[wire] = free.pop()
+            else:
+                slots[wire] = count
+                count += 1
+
+    for w in inputs:
+        allocate(w)
+    for w in inputs:
+        if w not in last:  # never read
+            free.append(slots[w])
+
+    for i, gate in enumerate(gates):
+        for w in gate["in"]:
+            allocate(w)
+        allocate(gate["id"])
+        # released after the output is allocated: a gate never overwrites its inputs
+        for w in {*gate["in"], gate["id"]}:
+            if last[w] == i:
+                free.append(slots[w])
+
+    return slots, count
+
+
+def _generate(circuit, digest, decode=True):
+    inputs = circuit.get("alice", []) + circuit.get("bob", [])
+    computed = set(inputs)
+    gates = []  # gates whose inputs are all computed, in order of id
+    for gate in sorted(circuit["gates"], key=lambda g: g["id"]):
+        if all(w in computed for w in gate["in"]):
+            gates.append(gate)
+            computed.add(gate["id"])
+
+    missing = [w for w in circuit["out"] if w not in computed]
+    if missing:
+        raise ValueError(f"Output wires {missing} of {circuit.get('id')} are never computed")
+
+    # wire -> suffix of the local variables holding its label (k: key, e: encr bit)
+    local, slots = allocate_slots(gates, circuit["out"], inputs)
+
+    name = f"evaluate_{digest[:16]}" if decode else f"evaluate_labels_{digest[:16]}"
+    lines = [f"def {name}(g_tables, pbits_out, a_inputs, b_inputs):"]
+    for party, wires in (("a_inputs", circuit.get("alice", [])), ("b_inputs", circuit.get("bob", []))):
+        for w in wires:
+            lines.append(f"    k{local[w]}, e{local[w]} = {party}[{w!r}]")
+
+    aes_invocations = 0
+    for gate in gates:
+        gate_id, gate_in = gate["id"], gate["in"]
+        if len(gate_in) < 2:
+            a = local[gate_in[0]]
+            msg = f"decrypt(k{a}, g_tables[{gate_id!r}][(e{a}, )])"
+        else:
+            a, b = local[gate_in[0]], local[gate_in[1]]
+            msg = f"decrypt(k{b}, decrypt(k{a}, g_tables[{gate_id!r}][(e{a}, e{b})]))"
+        out = local[gate_id]
+        lines.append(f"    k{out}, e{out} = loads({msg})")
+        aes_invocations += len(gate_in)
+
+    if decode:
+        outputs = ", ".join(f"{w!r}: e{local[w]} ^ pbits_out[{w!r}]" for w in circuit["out"])
+    else:
+        outputs = ", ".join(f"{w!r}: (k{local[w]}, e{local[w]})" for w in circuit["out"])
+    lines.append(f"    return {{{outputs}}}")
+
+    namespace = {"decrypt": decrypt, "loads": pickle.loads}
+    exec(compile("\n".join(lines), f"<circuit {circuit.get('id')} {digest[:16]}>", "exec"), namespace)
+
+    evaluator = namespace[name]
+    evaluator.gates = len(gates)
+    evaluator.aes_invocations = aes_invocations
+    evaluator.slots = slots
+    return evaluator
+
+
+# ADDED
+KEY_SIZE = 16  # size of a wire label in bytes
+MATERIALIZE_LIMIT = 1 << 20  # wires above which labels are derived on demand by default
+
+# Logical function of each 2-input gate type
+OPERATORS = {
+    "OR": lambda b1, b2: b1 or b2,
+    "AND": lambda b1, b2: b1 and b2,
+    "XOR": lambda b1, b2: b1 ^ b2,
+    "NOR": lambda b1, b2: not (b1 or b2),
+    "NAND": lambda b1, b2: not (b1 and b2),
+    "XNOR": lambda b1, b2: not (b1 ^ b2),
+}
+
+
+# ADDED
+class LabelPRG:
+    """AES-CTR pseudo-random generator of the labels and p-bits of a circuit.
+
+    Block 2 * i + b of the key stream is the label of the i-th wire for bit
+    b, so any label can be re-derived from (seed, wire index). P-bits are
+    taken from a separate part of the stream starting at block PBIT_BLOCK.
+
+    Args:
+        seed: Optional; the 16 bytes AES key (random by default).
+    """
+    PBIT_BLOCK = 1 << 64
+
+    def __init__(self, seed=None):
+        self.seed = seed or os.urandom(KEY_SIZE)
+
+    def _stream(self, block, size):
+        """Return 'size' bytes of key stream starting at 'block'."""
+        nonce = block.to_bytes(16, byteorder="big")
+        encryptor = Cipher(algorithms.AES(self.seed), modes.CTR(nonce)).encryptor()
+        return encryptor.update(bytes(size))
+
+    def labels(self, count):
+        """Return the labels of 'count' wires in one call."""
+        return self._stream(0, 2 * count * KEY_SIZE)
+
+    def label(self, index, bit):
+        """Return the label of the wire at 'index' for the given bit."""
+        return self._stream(2 * index + bit, KEY_SIZE)
+
+    def pbits(self, count):
+        """Return the p-bits of 'count' wires packed in bytes."""
+        return self._stream(self.PBIT_BLOCK, (count + 7) // 8)
+
+    def pbit(self, index):
+        """Return the p-bit of the wire at 'index'."""
+        block = self._stream(self.PBIT_BLOCK + (index >> 7), 16)
+        return (block[(index >> 3) & 15] >> (index & 7)) & 1
+
+
+# ADDED
+class LabelStore(Mapping):
+    """Wire labels of a circuit held in one contiguous buffer.
+
+    The two labels of the i-th wire are stored back to back at offset
+    2 * i * KEY_SIZE. Behaves like a read-only dict mapping each wire to its
+    pair of keys.
+
+    With a PRG and materialize=False no buffer is kept: labels are derived
+    from the PRG on demand and only explicitly set labels are stored.
+
+    Args:
+        wires: A list of the circuit wires.
+        prg: Optional; a LabelPRG generating the labels.
+        materialize: Optional; keep all labels in memory (True by default).
+    """
+    __slots__ = ("index", "buffer", "prg", "fixed")
+
+    def __init__(self, wires, prg=None, materialize=True):
+        self.index = {wire: i for i, wire in enumerate(wires)}
+        self.prg = prg
+        self.fixed = {}  # wire -> pair of keys set on a lazy store
+
+        if prg is None:
+            self.buffer = bytearray(2 * len(self.index) * KEY_SIZE)
+        elif materialize:
+            self.buffer = bytearray(prg.labels(len(self.index)))
+        else:
+            self.buffer = None
+
+    def label(self, wire, bit):
+        """Return the key of 'wire' for the given bit."""
+        if self.buffer is None:
+            if wire in self.fixed:
+                return self.fixed[wire][bit]
+            return self.prg.label(self.index[wire], bit)
+
+        offset = (2 * self.index[wire] + bit) * KEY_SIZE
+        return bytes(self.buffer[offset:offset + KEY_SIZE])
+
+    def set(self, wire, key0, key1):
+        """Set the pair of keys of 'wire'."""
+        if self.buffer is None:
+            self.fixed[wire] = (key0, key1)
+            return
+
+        offset = 2 * self.index[wire] * KEY_SIZE
+        self.buffer[offset:offset + 2 * KEY_SIZE] = key0 + key1
+
+    def __getitem__(self, wire):
+        return self.label(wire, 0), self.label(wire, 1)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+# ADDED
+class LiveLabels:
+    """Labels of the live wires of a lazy LabelStore while garbling.
+
+    Each wire gets a slot of a fixed-size buffer (see allocate_slots): its
+    labels are derived once, when first used, and kept until the slot is
+    taken by another wire. Same label() interface as LabelStore.
+
+    Args:
+        keys: A LabelStore without buffer (materialize=False).
+        slots: A dict mapping each wire to its slot.
+        count: Number of slots.
+    """
+    __slots__ = ("keys", "slots", "buffer", "owners")
+
+    def __init__(self, keys, slots, count):
+        self.keys = keys
+        self.slots = slots
+        self.buffer = bytearray(2 * count * KEY_SIZE)
+        self.owners = [None] * count  # wire whose labels are in each slot
+
+    def label(self, wire, bit):
+        slot = self.slots[wire]
+        offset = 2 * slot * KEY_SIZE
+        if self.owners[slot] != wire:
+            self.buffer[offset:offset + 2 * KEY_SIZE] = self.keys.label(wire, 0) + self.keys.label(wire, 1)
+            self.owners[slot] = wire
+
+        offset += bit * KEY_SIZE
+        return bytes(self.buffer[offset:offset + KEY_SIZE])
+
+
+# ADDED
+class PbitArray(Mapping):
+    """P-bits of a circuit packed in a bit array.
+
+    Behaves like a read-only dict mapping each wire to its p-bit.
+
+    Args:
+        wires: A list of the circuit wires.
+        prg: Optional; a LabelPRG generating the p-bits (all 0 otherwise).
+    """
+    __slots__ = ("index", "bits")
+
+    def __init__(self, wires, prg=None):
+        self.index = {wire: i for i, wire in enumerate(wires)}
+        if prg is None:
+            self.bits = bytearray((len(self.index) + 7) // 8)
+        else:
+            self.bits = bytearray(prg.pbits(len(self.index)))
+
+    def set(self, wire, pbit):
+        i = self.index[wire]
+        if pbit:
+            self.bits[i >> 3] |= 1 << (i & 7)
+        else:
+            self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def __getitem__(self, wire):
+        i = self.index[wire]
+        return (self.bits[i >> 3] >> (i & 7)) & 1
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 class GarbledGate:
     """A representation of a garbled gate.
 
     Args:
         gate: A dict containing gate spec.
-        keys: A dict mapping each wire to a pair of keys.
-        pbits: A dict mapping each wire to its p-bit.
+        keys: A LabelStore (or LiveLabels) holding the pair of keys of each wire.
+        pbits: A mapping from each wire to its p-bit.
+        garble: Optional; create the garbled table (True by default).
     """
-    def __init__(self, gate, keys, pbits):
-        self.keys = keys  # dict of yao circuit keys
-        self.pbits = pbits  # dict of p-bits
+    __slots__ = ("keys", "pbits", "input", "output", "gate_type", "garbled_table")
+
+    def __init__(self, gate, keys, pbits, garble=True):
+        self.keys = keys  # yao circuit keys
+        self.pbits = pbits  # p-bits
         self.input = gate["in"]  # list of inputs'ID
         self.output = gate["id"]  # ID of output
         self.gate_type = gate["type"]  # Gate type: OR, AND, ...
         self.garbled_table = {}  # The garbled table of the gate
-        # A clear representation of the garbled table for debugging purposes
-        self.clear_garbled_table = {}
-
-        # Create the garbled table according to the gate type
-        switch = {
-            "OR": lambda b1, b2: b1 or b2,
-            "AND": lambda b1, b2: b1 and b2,
-            "XOR": lambda b1, b2: b1 ^ b2,
-            "NOR": lambda b1, b2: not (b1 or b2),
-            "NAND": lambda b1, b2: not (b1 and b2),
-            "XNOR": lambda b1, b2: not (b1 ^ b2),
-        }
+
+        if not garble:
+            return
 
         # NOT gate is a special case since it has only one input
         if (self.gate_type == "NOT"):
             self._gen_garbled_table_not()
         else:
-            operator = switch[self.gate_type]
-            self._gen_garbled_table(operator)
+            self._gen_garbled_table(OPERATORS[self.gate_type])
 
     def _gen_garbled_table_not(self):
         """Create the garbled table of a NOT gate."""
@@ -146,17 +493,13 @@ class GarbledGate:
             # Compute encrypted bit with the p-bit table
             encr_bit_out = bit_out ^ self.pbits[out]
             # Retrieve related keys
-            key_in = self.keys[inp][bit_in]
-            key_out = self.keys[out][bit_out]
+            key_in = self.keys.label(inp, bit_in)
+            key_out = self.keys.label(out, bit_out)
 
             # Serialize the output key along with the encrypted bit
             msg = pickle.dumps((key_out, encr_bit_out))
             # Encrypt message and add it to the garbled table
             self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
-            # Add to the clear table indexes of each keys
-            self.clear_garbled_table[(encr_bit_in, )] = [(inp, bit_in),
-                                                         (out, bit_out),
-                                                         encr_bit_out]
 
     def _gen_garbled_table(self, operator):
         """Create the garbled table of a 2-input gate.
@@ -173,21 +516,45 @@ class GarbledGate:
                 bit_b = encr_bit_b ^ self.pbits[in_b]
                 bit_out = int(operator(bit_a, bit_b))
                 encr_bit_out = bit_out ^ self.pbits[out]
-                key_a = self.keys[in_a][bit_a]
-                key_b = self.keys[in_b][bit_b]
-                key_out = self.keys[out][bit_out]
+                key_a = self.keys.label(in_a, bit_a)
+                key_b = self.keys.label(in_b, bit_b)
+                key_out = self.keys.label(out, bit_out)
 
                 msg = pickle.dumps((key_out, encr_bit_out))
                 self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
                     key_a, encrypt(key_b, msg))
-                self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
-                    (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
+
+    def clear_garbled_table(self):
+        """Return a clear representation of the garbled table for debugging
+        purposes: indexes of the keys of each entry and the encrypted bit."""
+        clear_table = {}
+
+        if self.gate_type == "NOT":
+            inp, out = self.input[0], self.output
+            for encr_bit_in in (0, 1):
+                bit_in = encr_bit_in ^ self.pbits[inp]
+                bit_out = int(not (bit_in))
+                clear_table[(encr_bit_in, )] = [(inp, bit_in), (out, bit_out),
+                                                bit_out ^ self.pbits[out]]
+            return clear_table
+
+        operator = OPERATORS[self.gate_type]
+        in_a, in_b, out = self.input[0], self.input[1], self.output
+        for encr_bit_a in (0, 1):
+            for encr_bit_b in (0, 1):
+                bit_a = encr_bit_a ^ self.pbits[in_a]
+                bit_b = encr_bit_b ^ self.pbits[in_b]
+                bit_out = int(operator(bit_a, bit_b))
+                clear_table[(encr_bit_a, encr_bit_b)] = [
+                    (in_a, bit_a), (in_b, bit_b), (out, bit_out),
+                    bit_out ^ self.pbits[out]
                 ]
+        return clear_table
 
     def print_garbled_table(self):
         """Print a clear representation of the garbled table."""
         print(f"GATE: {self.output}, TYPE: {self.gate_type}")
-        for k, v in self.clear_garbled_table.items():
+        for k, v in self.clear_garbled_table().items():
             # If it's a 2-input gate
             if len(k) > 1:
                 key_a, key_b, key_out = v[0], v[1], v[2]
@@ -208,61 +575,113 @@ class GarbledGate:
         return self.garbled_table
 
 
+# ADDED
+def circuit_wires(circuit):
+    """Return the sorted list of wire IDs of a circuit.
+
+    The position of a wire in this list is its index in the label PRG.
+    """
+    wires = set()
+    for gate in circuit["gates"]:
+        wires.add(gate["id"])
+        wires.update(gate["in"])
+    return sorted(wires)
+
+
+# ADDED
+def _materialize(wires, materialize):
+    return len(wires) <= MATERIALIZE_LIMIT if materialize is None else materialize
+
+
+# ADDED
+def derive_labels(circuit, seed, materialize=None):
+    """Re-derive the keys and p-bits of a circuit garbled with 'seed'.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        seed: The PRG seed of the garbled circuit.
+        materialize: Optional; keep all labels in memory (by default only
+            up to MATERIALIZE_LIMIT wires).
+
+    Returns:
+        A pair (LabelStore, PbitArray).
+    """
+    wires = circuit_wires(circuit)
+    prg = LabelPRG(seed)
+    return LabelStore(wires, prg, _materialize(wires, materialize)), PbitArray(wires, prg)
+
+
 class GarbledCircuit:
     """A representation of a garbled circuit.
 
     Args:
         circuit: A dict containing circuit spec.
         pbits: Optional; a dict of p-bits for the given circuit.
+        keys: Optional; a dict of pairs of keys for the given circuit (e.g.
+            the output labels of a previous evaluation carried to its inputs).
+        metrics: Optional; a Metrics instance collecting the "garble" phase.
+        seed: Optional; the PRG seed all labels and p-bits are derived from.
+        materialize: Optional; keep all labels in memory rather than
+            re-deriving them from the seed (by default only up to
+            MATERIALIZE_LIMIT wires). Without, garbling keeps the labels of
+            live wires only (see LiveLabels).
     """
-    def __init__(self, circuit, pbits={}):
+    def __init__(self, circuit, pbits={}, metrics=NULL_METRICS, seed=None,
+                 materialize=None, keys={}):
         self.circuit = circuit
+        self.metrics = metrics
+        self.prg = LabelPRG(seed)
+        self.seed = self.prg.seed
         self.gates = circuit["gates"]  # list of gates
-        self.wires = set()  # list of circuit wires
+        self.wires = []  # list of circuit wires
 
-        self.pbits = {}  # dict of p-bits
-        self.keys = {}  # dict of keys
+        self.pbits = None  # p-bits packed in a bit array
+        self.keys = None  # keys held in a contiguous buffer
         self.garbled_tables = {}  # dict of garbled tables
 
         # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
+        self.wires = circuit_wires(circuit)
 
-        self._gen_pbits(pbits)
-        self._gen_keys()
-        self._gen_garbled_tables()
+        with metrics.timer('garble'):
+            self._gen_pbits(pbits)
+            self._gen_keys(_materialize(self.wires, materialize), keys)
+            self._gen_garbled_tables()
 
     def _gen_pbits(self, pbits):
-        """Create a dict mapping each wire to a random p-bit."""
-        if pbits:
-            self.pbits = pbits
-        else:
-            self.pbits = {wire: random.randint(0, 1) for wire in self.wires}
+        """Create a bit array mapping each wire to a random p-bit."""
+        self.pbits = PbitArray(self.wires, self.prg)
+        for wire, pbit in pbits.items():
+            self.pbits.set(wire, pbit)
 
-    def _gen_keys(self):
-        """Create pair of keys for each wire."""
-        for wire in self.wires:
-            self.keys[wire] = (generate_key(), generate_key())
+    def _gen_keys(self, materialize, keys):
+        """Create pair of keys for each wire, in one PRG call."""
+        self.keys = LabelStore(self.wires, self.prg, materialize)
+        for wire, (key0, key1) in keys.items():
+            self.keys.set(wire, key0, key1)
 
     def _gen_garbled_tables(self):
         """Create the garbled table of each gate."""
+        keys = self.keys
+        if keys.buffer is None:  # derive each label once, while its wire is live
+            keys = LiveLabels(self.keys, *allocate_slots(self.gates, self.circuit["out"]))
+
         for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.pbits)
+            garbled_gate = GarbledGate(gate, keys, self.pbits)
             self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+            # one encryption per input wire and table entry
+            self.metrics.incr('aes_invocations', len(gate["in"]) * 2**len(gate["in"]))
 
     def print_garbled_tables(self):
         """Print p-bits and a clear representation of all garbled tables."""
         print(f"======== {self.circuit['id']} ========")
         print(f"P-BITS: {self.pbits}")
         for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.pbits)
+            garbled_table = GarbledGate(gate, self.keys, self.pbits, garble=False)
             garbled_table.print_garbled_table()
         print()
 
     def get_pbits(self):
-        """Return dict mapping each wire to its p-bit."""
+        """Return a mapping from each wire to its p-bit."""
         return self.pbits
 
     def get_garbled_tables(self):
@@ -270,5 +689,5 @@ class GarbledCircuit:
         return self.garbled_tables
 
     def get_keys(self):
-        """Return dict mapping each wire to its pair of keys."""
+        """Return a mapping from each wire to its pair of keys."""
         return self.keys
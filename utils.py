@@ -1,3 +1,12 @@
+import array
+import mmap
+import struct
+import sys
+
+# Binary input format: header followed by little-endian unsigned integers
+BINARY_MAGIC = b"YAOI"
+BINARY_HEADER = struct.Struct("<4sBBQ")  # magic, bit size, item size (bytes), count
+TYPECODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}  # item size -> array typecode
 
 
 def parse_input_file(file_path: str, bit_size: int):
@@ -8,17 +17,8 @@ def parse_input_file(file_path: str, bit_size: int):
     :param bit_size: The number of inputs to the circuit for a party
     :return: List[str] of number in binary (of size bit_size)
     """
-    max_int = 2 ** bit_size
-
-    with open(file_path, 'r') as file:
-        contents = file.read().strip().split(' ')
-        nums = [int(c) for c in contents]
-
-        # If any number is out of range
-        if any([n < 0 or max_int < n for n in nums]):
-            raise ValueError("Input contains a number which is out of range")
-
-        return [bin(n)[2:].zfill(bit_size) for n in nums]
+    inputs = load_inputs(file_path, bit_size)
+    return [bin(n)[2:].zfill(bit_size) for n in inputs.values]
 
 
 def parse_circuit_output(result: dict):
@@ -31,3 +31,190 @@ def parse_circuit_output(result: dict):
     output_str = ''.join([str(result[k]) for k in result.keys()])
     output_str = output_str[::-1]
     return int(output_str, 2)
+
+
+def _item_size(bit_size: int):
+    """Smallest item size in bytes which holds a number of bit_size bits"""
+    for size in sorted(TYPECODES):
+        if bit_size <= size * 8 and array.array(TYPECODES[size]).itemsize == size:
+            return size
+    raise ValueError(f"Bit size must be at most 64: {bit_size}")
+
+
+def iter_input_file(file_path: str, chunk_size: int = 1 << 20):
+    """
+    Streams the integers of a text input file without reading the whole file
+
+    :param file_path: Path to input file for the party
+    :param chunk_size: Number of characters read at once
+    :return: Iterator[int] over the whitespace separated numbers
+    """
+    with open(file_path, 'r') as file:
+        rest = ''
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+
+            tokens = (rest + chunk).split()
+            # the last token may continue in the next chunk
+            rest = '' if chunk[-1].isspace() else tokens.pop()
+            for token in tokens:
+                yield int(token)
+
+        if rest:
+            yield int(rest)
+
+
+class InputArray:
+    """
+    A party's input numbers held in a packed array of unsigned integers
+
+    The array is either built from a text file or memory-mapped from a binary
+    input file. Bits are extracted from the integers directly, most significant
+    bit first, to match the order of the party's wires in the circuit.
+    """
+
+    def __init__(self, values, bit_size: int, mapping=None):
+        self.values = values
+        self.bit_size = bit_size
+        self._shifts = tuple(range(bit_size - 1, -1, -1))
+        self._mapping = mapping  # mmap backing 'values', if any
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i: int):
+        return self.values[i]
+
+    def bits(self, i: int):
+        """
+        :param i: Index of the input
+        :return: List[int] of the bits of the i-th number (of size bit_size)
+        """
+        value = self.values[i]
+        return [(value >> shift) & 1 for shift in self._shifts]
+
+    def max(self):
+        return max(self.values)
+
+    def aggregate(self):
+        """
+        Reduces the inputs locally with max, which is associative
+
+        :return: InputArray holding the single aggregated number
+        """
+        values = array.array(TYPECODES[_item_size(self.bit_size)], [self.max()])
+        return InputArray(values, self.bit_size)
+
+    def close(self):
+        if self._mapping is not None:
+            self.values.release()
+            self._mapping.close()
+            self._mapping = None
+
+
+def read_text_inputs(file_path: str, bit_size: int, chunk_size: int = 1 << 20):
+    """
+    Reads a text input file chunk by chunk into a packed array
+
+    :param file_path: Path to input file for the party
+    :param bit_size: The number of inputs to the circuit for a party
+    :param chunk_size: Number of characters read at once
+    :return: InputArray of the numbers
+    """
+    max_int = 2 ** bit_size
+    values = array.array(TYPECODES[_item_size(bit_size)])
+
+    for n in iter_input_file(file_path, chunk_size):
+        # If any number is out of range
+        if n < 0 or max_int <= n:
+            raise ValueError("Input contains a number which is out of range")
+        values.append(n)
+
+    return InputArray(values, bit_size)
+
+
+def write_binary_inputs(file_path: str, nums, bit_size: int):
+    """
+    Writes numbers to a binary input file
+
+    :param file_path: Path of the binary input file (.bin)
+    :param nums: Iterable[int] of numbers in range [0, 2 ** bit_size)
+    :param bit_size: The number of inputs to the circuit for a party
+    """
+    item_size = _item_size(bit_size)
+    max_int = 2 ** bit_size
+    values = array.array(TYPECODES[item_size], nums)
+
+    if any(n >= max_int for n in values):
+        raise ValueError("Input contains a number which is out of range")
+
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    with open(file_path, 'wb') as file:
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, bit_size, item_size, len(values)))
+        file.write(values.tobytes())
+
+
+def read_binary_inputs(file_path: str, bit_size: int):
+    """
+    Memory-maps a binary input file as a packed array
+
+    :param file_path: Path of the binary input file (.bin)
+    :param bit_size: The number of inputs to the circuit for a party
+    :return: InputArray of the numbers
+    """
+    with open(file_path, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, file_bit_size, item_size, count = BINARY_HEADER.unpack_from(mapping, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"Not a binary input file: {file_path}")
+    if file_bit_size > bit_size:
+        raise ValueError(f"Input file uses {file_bit_size} bits, circuit expects {bit_size}")
+
+    data = memoryview(mapping)[BINARY_HEADER.size:BINARY_HEADER.size + count * item_size]
+
+    if sys.byteorder == 'big':
+        values = array.array(TYPECODES[item_size], data)
+        values.byteswap()
+        data.release()
+        mapping.close()
+        return InputArray(values, bit_size)
+
+    return InputArray(data.cast(TYPECODES[item_size]), bit_size, mapping)
+
+
+def load_inputs(file_path: str, bit_size: int):
+    """
+    Loads a party's inputs from a text (.txt) or binary (.bin) input file
+
+    :param file_path: Path to input file for the party
+    :param bit_size: The number of inputs to the circuit for a party
+    :return: InputArray of the numbers
+    """
+    if file_path.endswith('.bin'):
+        return read_binary_inputs(file_path, bit_size)
+    return read_text_inputs(file_path, bit_size)
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(prog="Input converter", description="Convert a text input file to the binary input format")
+    parser.add_argument("input", help="Path to input file (.txt)")
+    parser.add_argument("output", help="Path for binary input file (.bin)")
+    parser.add_argument("-b", "--bit-size", help="Number of input wires for a party in the circuit", default=4)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        raise FileNotFoundError(f"Input file file not found: {args.input}")
+
+    if ".bin" not in args.output:
+        raise Exception(f"Output file must be a .bin file: {args.output}")
+
+    write_binary_inputs(args.output, iter_input_file(args.input), int(args.bit_size))